@@ -0,0 +1,222 @@
+"""AI drafting of announcements.
+
+Drafts go through three layers before reaching the model:
+
+- a TTL cache keyed by a hash of the prompt, so repeated drafts are free;
+- a global limiter: at most ``AI_DRAFT_CONCURRENCY`` completions run at once
+  and at most ``AI_DRAFT_MAX_QUEUE`` wait for a slot; beyond that callers get
+  429 instead of piling more calls onto the provider;
+- the backend, which yields the draft in chunks for SSE streaming.
+
+``AI_DRAFT_BACKEND=fake`` swaps the Emergent LLM for ``FakeDraftBackend``,
+which streams a canned draft with configurable latency. ``python
+ai_drafting.py bench [drafts]`` uses it to measure latency and throughput
+through the limiter offline.
+"""
+from fastapi import HTTPException, status
+from typing import AsyncIterator
+import asyncio
+import hashlib
+import logging
+import os
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+AI_DRAFT_CONCURRENCY = int(os.getenv("AI_DRAFT_CONCURRENCY", "4"))
+AI_DRAFT_MAX_QUEUE = int(os.getenv("AI_DRAFT_MAX_QUEUE", "20"))
+AI_DRAFT_CACHE_SIZE = int(os.getenv("AI_DRAFT_CACHE_SIZE", "256"))
+AI_DRAFT_CACHE_TTL = float(os.getenv("AI_DRAFT_CACHE_TTL", "3600"))
+
+SYSTEM_MESSAGE = "You are a professional HOA announcement writer. Create clear, friendly, and professional announcements for homeowners association members."
+MODEL_PROVIDER = "openai"
+MODEL_NAME = "gpt-5.2"
+
+
+def build_prompt(prompt: str) -> str:
+    return f"Create a professional HOA announcement about: {prompt}"
+
+
+class EmergentDraftBackend:
+    """The Emergent LLM gateway.
+
+    ``LlmChat`` returns the completion in one piece, so the stream is a single
+    chunk; clients still get the SSE framing and the limiter and cache apply.
+    """
+
+    name = f"{MODEL_PROVIDER}/{MODEL_NAME}"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def stream(self, prompt: str, session_id: str) -> AsyncIterator[str]:
+        from emergentintegrations.ai.llm_chat_engine import LlmChat, UserMessage
+
+        # LlmChat keeps message history, so each draft gets its own chat
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=SYSTEM_MESSAGE
+        ).with_model(MODEL_PROVIDER, MODEL_NAME)
+
+        response = await chat.send_message(UserMessage(text=build_prompt(prompt)))
+        yield response.text
+
+
+class FakeDraftBackend:
+    """Offline stand-in that streams a canned draft word by word."""
+
+    name = "fake"
+
+    def __init__(self, first_token_latency: float = 0.5, token_delay: float = 0.02):
+        self.first_token_latency = first_token_latency
+        self.token_delay = token_delay
+
+    async def stream(self, prompt: str, session_id: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.first_token_latency)
+        draft = (
+            f"Dear Residents,\n\nWe would like to inform you about the following: {prompt}\n\n"
+            "Please reach out to the board if you have any questions.\n\nThank you,\nThe Board"
+        )
+        for word in draft.split(" "):
+            yield word + " "
+            await asyncio.sleep(self.token_delay)
+
+
+class DraftLimiter:
+    def __init__(self, concurrency: int = AI_DRAFT_CONCURRENCY, max_queue: int = AI_DRAFT_MAX_QUEUE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._slots = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def check(self):
+        """Raise 429 if the wait queue is full."""
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many drafts in progress, please try again shortly",
+                headers={"Retry-After": "5"}
+            )
+
+    async def acquire(self):
+        self.check()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+
+class DraftService:
+    def __init__(self, backend):
+        self.backend = backend
+        self.limiter = DraftLimiter()
+        self.cache = TTLCache(maxsize=AI_DRAFT_CACHE_SIZE, ttl=AI_DRAFT_CACHE_TTL)
+        self.completed = 0
+
+    def cache_key(self, prompt: str) -> str:
+        normalized = " ".join(prompt.split()).lower()
+        return hashlib.sha256(f"{self.backend.name}\n{normalized}".encode()).hexdigest()
+
+    def cached(self, prompt: str):
+        return self.cache.get(self.cache_key(prompt))
+
+    async def stream(self, prompt: str, session_id: str) -> AsyncIterator[str]:
+        """Stream a fresh draft, waiting for a limiter slot first."""
+        # Acquired inside the generator so a stream that never starts holds no slot
+        await self.limiter.acquire()
+        parts = []
+        try:
+            async for chunk in self.backend.stream(prompt, session_id):
+                parts.append(chunk)
+                yield chunk
+        finally:
+            self.limiter.release()
+
+        # Only complete drafts are cached
+        self.cache.set(self.cache_key(prompt), "".join(parts))
+        self.completed += 1
+
+    async def draft(self, prompt: str, session_id: str) -> str:
+        cached = self.cached(prompt)
+        if cached is not None:
+            return cached
+
+        return "".join([chunk async for chunk in self.stream(prompt, session_id)])
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "concurrency": self.limiter.concurrency,
+            "active": self.limiter.active,
+            "waiting": self.limiter.waiting,
+            "max_queue": self.limiter.max_queue,
+            "rejected": self.limiter.rejected,
+            "completed": self.completed,
+            "cache": self.cache.stats(),
+        }
+
+
+def create_draft_service() -> DraftService:
+    if os.getenv("AI_DRAFT_BACKEND", "emergent") == "fake":
+        backend = FakeDraftBackend(
+            first_token_latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+            token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.02"))
+        )
+    else:
+        backend = EmergentDraftBackend(os.getenv("EMERGENT_LLM_KEY"))
+
+    return DraftService(backend)
+
+
+if __name__ == "__main__":
+    import statistics
+    import sys
+    import time
+
+    async def bench(drafts: int):
+        service = DraftService(FakeDraftBackend(
+            first_token_latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+            token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.02"))
+        ))
+        first_token = []
+        rejected = 0
+
+        async def one(i):
+            nonlocal rejected
+            start = time.perf_counter()
+            first = None
+            try:
+                async for _ in service.stream(f"bench prompt number {i}", f"bench_{i}"):
+                    if first is None:
+                        first = time.perf_counter() - start
+                        first_token.append(first)
+            except HTTPException:
+                rejected += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(drafts)))
+        elapsed = time.perf_counter() - start
+
+        first_token.sort()
+        print(f"drafts={drafts} completed={service.completed} rejected={rejected} elapsed={elapsed:.2f}s")
+        if first_token:
+            print(
+                f"first token p50={statistics.median(first_token) * 1000:.0f}ms "
+                f"p95={first_token[int(len(first_token) * 0.95) - 1] * 1000:.0f}ms "
+                f"throughput={service.completed / elapsed:.1f} drafts/s"
+            )
+
+    if sys.argv[1:2] != ["bench"]:
+        sys.exit("usage: python ai_drafting.py bench [drafts]")
+    asyncio.run(bench(int(sys.argv[2]) if len(sys.argv) > 2 else 20))
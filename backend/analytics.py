@@ -0,0 +1,208 @@
+"""Incrementally maintained counters for the admin analytics dashboard.
+
+The write paths call the ``record_*`` helpers, which apply ``$inc`` updates to
+a handful of rollup documents in ``analytics_rollups``:
+
+- ``totals``: users, payments, payments by status, revenue and revenue by
+  payment method
+- ``month:YYYY-MM``: the same figures for one calendar month (users by sign-up
+  month, payments by creation month, revenue by the month it was received)
+
+``rebuild_rollups`` recomputes everything from the source collections to
+correct any drift; run it with ``python analytics.py rebuild``.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from models import PaymentStatus
+
+TOTALS_ID = "totals"
+
+
+def _month_of(timestamp=None) -> str:
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    if isinstance(timestamp, str):
+        return timestamp[:7]
+    return timestamp.strftime("%Y-%m")
+
+
+def _key(value) -> str:
+    # Enum members (PaymentStatus, PaymentMethod) as their stored string value
+    return getattr(value, "value", value)
+
+
+def _month_id(month: str) -> str:
+    return f"month:{month}"
+
+
+async def _increment(db, month: str, inc: dict):
+    await db.analytics_rollups.update_one(
+        {"_id": TOTALS_ID}, {"$inc": inc}, upsert=True
+    )
+    await db.analytics_rollups.update_one(
+        {"_id": _month_id(month)},
+        {"$inc": inc, "$setOnInsert": {"month": month}},
+        upsert=True
+    )
+
+
+async def record_user_created(db, user: dict):
+    await _increment(db, _month_of(user.get("created_at")), {"users": 1})
+
+
+async def record_payment_created(db, payment: dict):
+    await _increment(db, _month_of(payment.get("created_at")), {
+        "payments": 1,
+        f"payments_by_status.{_key(payment['status'])}": 1
+    })
+
+
+async def record_payment_status_change(db, payment: dict, new_status: str):
+    """Apply a status transition; ``payment`` is the document before the change."""
+    old_status = _key(payment["status"])
+    new_status = _key(new_status)
+    if old_status == new_status:
+        return
+
+    # Status counts stay attributed to the month the payment was created
+    await _increment(db, _month_of(payment.get("created_at")), {
+        f"payments_by_status.{old_status}": -1,
+        f"payments_by_status.{new_status}": 1
+    })
+
+    # Revenue is booked in the month the money arrives (or is reversed)
+    sign = 0
+    if new_status == PaymentStatus.SUCCESSFUL:
+        sign = 1
+    elif old_status == PaymentStatus.SUCCESSFUL:
+        sign = -1
+
+    if sign:
+        amount = sign * payment["amount"]
+        await _increment(db, _month_of(), {
+            "successful_payments": sign,
+            "revenue": amount,
+            f"revenue_by_method.{_key(payment['payment_method'])}": amount
+        })
+
+
+async def get_rollups(db, months: int = 0) -> dict:
+    totals = await db.analytics_rollups.find_one({"_id": TOTALS_ID})
+    if totals is None:
+        await rebuild_rollups(db)
+        totals = await db.analytics_rollups.find_one({"_id": TOTALS_ID}) or {}
+
+    result = {
+        "total_users": totals.get("users", 0),
+        "total_payments": totals.get("payments", 0),
+        "successful_payments": totals.get("successful_payments", 0),
+        "total_revenue": totals.get("revenue", 0),
+        "payments_by_status": totals.get("payments_by_status", {}),
+        "revenue_by_method": totals.get("revenue_by_method", {}),
+    }
+
+    if months:
+        series = await db.analytics_rollups.find(
+            {"_id": {"$regex": "^month:"}},
+            {"_id": 0}
+        ).sort("_id", -1).limit(months).to_list(months)
+        result["series"] = list(reversed(series))
+
+    return result
+
+
+def _month_expression(field: str) -> dict:
+    # ISO strings left over from before convert_timestamps are sliced instead
+    return {"$cond": [
+        {"$eq": [{"$type": f"${field}"}, "date"]},
+        {"$dateToString": {"format": "%Y-%m", "date": f"${field}"}},
+        {"$substrCP": [f"${field}", 0, 7]}
+    ]}
+
+
+async def rebuild_rollups(db, now: Optional[datetime] = None):
+    """Recompute every rollup document from the source collections."""
+    rollups = {TOTALS_ID: {"_id": TOTALS_ID}}
+
+    def month_doc(month: str) -> dict:
+        key = _month_id(month)
+        if key not in rollups:
+            rollups[key] = {"_id": key, "month": month}
+        return rollups[key]
+
+    def add(doc: dict, path: str, value):
+        target = doc
+        *parents, leaf = path.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = target.get(leaf, 0) + value
+
+    async for row in db.users.aggregate([
+        {"$group": {"_id": _month_expression("created_at"), "count": {"$sum": 1}}}
+    ]):
+        add(rollups[TOTALS_ID], "users", row["count"])
+        if row["_id"]:
+            add(month_doc(row["_id"]), "users", row["count"])
+
+    async for row in db.payments.aggregate([
+        {"$group": {
+            "_id": {"month": _month_expression("created_at"), "status": "$status"},
+            "count": {"$sum": 1}
+        }}
+    ]):
+        status_path = f"payments_by_status.{row['_id']['status']}"
+        add(rollups[TOTALS_ID], "payments", row["count"])
+        add(rollups[TOTALS_ID], status_path, row["count"])
+        if row["_id"]["month"]:
+            add(month_doc(row["_id"]["month"]), "payments", row["count"])
+            add(month_doc(row["_id"]["month"]), status_path, row["count"])
+
+    # The success time is not stored separately; updated_at is when it was set
+    async for row in db.payments.aggregate([
+        {"$match": {"status": PaymentStatus.SUCCESSFUL}},
+        {"$group": {
+            "_id": {"month": _month_expression("updated_at"), "method": "$payment_method"},
+            "count": {"$sum": 1},
+            "revenue": {"$sum": "$amount"}
+        }}
+    ]):
+        method_path = f"revenue_by_method.{row['_id']['method']}"
+        targets = [rollups[TOTALS_ID]]
+        if row["_id"]["month"]:
+            targets.append(month_doc(row["_id"]["month"]))
+        for doc in targets:
+            add(doc, "successful_payments", row["count"])
+            add(doc, "revenue", row["revenue"])
+            add(doc, method_path, row["revenue"])
+
+    for doc in rollups.values():
+        doc["rebuilt_at"] = now or datetime.now(timezone.utc)
+        await db.analytics_rollups.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+
+    await db.analytics_rollups.delete_many({"_id": {"$nin": list(rollups)}})
+
+    return len(rollups)
+
+
+if __name__ == "__main__":
+    import asyncio
+    import os
+    import sys
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+        try:
+            print(f"rebuilt {await rebuild_rollups(db)} rollup documents")
+        finally:
+            client.close()
+
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python analytics.py rebuild")
+    asyncio.run(main())
@@ -1,17 +1,72 @@
 from fastapi import Request, HTTPException, status
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta, timezone
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import math
 import os
-import aiohttp
+import time
+import uuid
+
+from cache import TTLCache
+from http_client import http_client
+from singleflight import coalesce
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 7
+ACCESS_TOKEN_TYPE = "access"
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "30"))
+
+# bcrypt cost: pinned with BCRYPT_ROUNDS, otherwise calibrated by the first
+# worker to start so one hash takes about BCRYPT_TARGET_MS, and stored in
+# db.settings for every other worker. Never below the passlib default of 12.
+BCRYPT_ROUNDS = os.getenv("BCRYPT_ROUNDS")
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = 12
+BCRYPT_MAX_ROUNDS = 16
+BCRYPT_SAMPLE_ROUNDS = 10
+BCRYPT_SAMPLES = 5
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "100"))
+
+EMERGENT_SESSION_DATA_URL = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+
+logger = logging.getLogger(__name__)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+# Only touched on the event loop; the executor threads just run the hash
+_hash_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+_hash_waiting = 0
+_hash_active = 0
+
+# token -> user document, so steady-state requests skip the identity lookups
+principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+)
+
+# session_id -> exchanged user data, absorbs repeated callbacks for one login
+session_exchange_cache = TTLCache(
+    maxsize=1000,
+    ttl=float(os.getenv("SESSION_EXCHANGE_CACHE_TTL", "60"))
+)
+
+# jti of access tokens revoked at logout, mirrored from db.revoked_tokens
+_revoked_jtis = set()
+_revocations_loaded_at = 0.0
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -21,6 +76,97 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def _set_bcrypt_rounds(rounds: int):
+    # No max_rounds: needs_update() only flags hashes weaker than the current cost
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+
+
+def _calibrate_bcrypt_rounds() -> int:
+    # The first hash pays for imports and cold caches; don't time it
+    pwd_context.hash("calibration", rounds=BCRYPT_SAMPLE_ROUNDS)
+    
+    samples = []
+    for _ in range(BCRYPT_SAMPLES):
+        start = time.perf_counter()
+        pwd_context.hash("calibration", rounds=BCRYPT_SAMPLE_ROUNDS)
+        samples.append((time.perf_counter() - start) * 1000)
+    elapsed_ms = sorted(samples)[len(samples) // 2]
+    
+    # Every extra round doubles the cost
+    extra = math.floor(math.log2(BCRYPT_TARGET_MS / max(elapsed_ms, 1e-3)))
+    return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, BCRYPT_SAMPLE_ROUNDS + extra))
+
+
+async def configure_password_hashing(db):
+    """Pick the bcrypt cost shared by every worker. Called once at startup."""
+    if BCRYPT_ROUNDS:
+        rounds = max(BCRYPT_MIN_ROUNDS, int(BCRYPT_ROUNDS))
+    else:
+        setting = await db.settings.find_one({"_id": "bcrypt_rounds"})
+        if setting is None:
+            loop = asyncio.get_running_loop()
+            calibrated = await loop.run_in_executor(_hash_executor, _calibrate_bcrypt_rounds)
+            # Workers starting together may all calibrate; the first stored cost wins
+            setting = await db.settings.find_one_and_update(
+                {"_id": "bcrypt_rounds"},
+                {"$setOnInsert": {"rounds": calibrated, "calibrated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        rounds = max(BCRYPT_MIN_ROUNDS, setting["rounds"])
+    
+    _set_bcrypt_rounds(rounds)
+    logger.info(f"Using bcrypt cost {rounds}")
+
+
+async def _run_hashing(func, *args):
+    global _hash_waiting, _hash_active
+    
+    if _hash_waiting >= PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please try again"
+        )
+    
+    _hash_waiting += 1
+    try:
+        await _hash_slots.acquire()
+    finally:
+        _hash_waiting -= 1
+    
+    _hash_active += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_active -= 1
+        _hash_slots.release()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    if not hashed_password:
+        return False
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+
+def password_hashing_stats() -> dict:
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "active": _hash_active,
+        "queue_depth": _hash_waiting,
+        "max_queue": PASSWORD_HASH_MAX_QUEUE,
+        "rounds": pwd_context.to_dict().get("bcrypt__default_rounds"),
+    }
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -28,14 +174,65 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.now(timezone.utc) + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "typ": ACCESS_TOKEN_TYPE, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-async def get_current_user(request: Request, db):
-    """REMINDER: DO NOT HARDCODE THE URL, OR ADD ANY FALLBACKS OR REDIRECT URLS, THIS BREAKS THE AUTH"""
+def _looks_like_jwt(token: str) -> bool:
+    # Access tokens are JWTs (header.payload.signature); session tokens are opaque
+    return token.count(".") == 2
+
+
+def _decode_access_token(token: str) -> Optional[dict]:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    
+    # Tokens issued before typ was added carry no type and are still accepted
+    if payload.get("typ", ACCESS_TOKEN_TYPE) != ACCESS_TOKEN_TYPE:
+        return None
+    
+    return payload
+
+
+async def _refresh_revocations(db):
+    global _revocations_loaded_at
+    
+    if time.monotonic() - _revocations_loaded_at < REVOCATION_REFRESH_SECONDS:
+        return
+    _revocations_loaded_at = time.monotonic()
     
+    revoked = await db.revoked_tokens.find(
+        {"expires_at": {"$gt": datetime.now(timezone.utc)}},
+        {"_id": 0, "jti": 1}
+    ).to_list(None)
+    
+    _revoked_jtis.clear()
+    _revoked_jtis.update(doc["jti"] for doc in revoked)
+
+
+async def revoke_access_token(token: str, db):
+    """Revoke a JWT access token until it expires (logout)."""
+    invalidate_token(token)
+    
+    payload = _decode_access_token(token) if _looks_like_jwt(token) else None
+    if not payload or "jti" not in payload:
+        return
+    
+    _revoked_jtis.add(payload["jti"])
+    await db.revoked_tokens.update_one(
+        {"jti": payload["jti"]},
+        {"$set": {
+            "jti": payload["jti"],
+            "expires_at": datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+        }},
+        upsert=True
+    )
+
+
+def get_request_token(request: Request) -> Optional[str]:
     # Try to get token from cookie first
     token = request.cookies.get("session_token")
     
@@ -45,61 +242,108 @@ async def get_current_user(request: Request, db):
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header.replace("Bearer ", "")
     
+    return token
+
+
+def invalidate_token(token: str):
+    """Forget the cached principal for a token (logout)."""
+    principal_cache.pop(token)
+
+
+def invalidate_user(user_id: str):
+    """Forget every cached principal of a user (profile or role changes)."""
+    principal_cache.invalidate_where(lambda entry: entry["user_id"] == user_id)
+
+
+async def get_current_user(request: Request, db):
+    """REMINDER: DO NOT HARDCODE THE URL, OR ADD ANY FALLBACKS OR REDIRECT URLS, THIS BREAKS THE AUTH"""
+    
+    token = get_request_token(request)
+    
     if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated"
         )
     
+    cached = principal_cache.get(token)
+    if cached is not None:
+        return dict(cached)
+    
+    user, expires_at = await _load_principal(token, db)
+    
+    ttl = (expires_at - datetime.now(timezone.utc)).total_seconds()
+    principal_cache.set(token, user, ttl=ttl)
+    
+    return dict(user)
+
+
+# Concurrent first requests with the same token share one set of lookups
+@coalesce("principal", key=lambda token, db: token)
+async def _load_principal(token: str, db):
+    """Resolve a token to ``(user, expires_at)`` with database lookups."""
+    # Our own JWTs are verified locally and never probe the sessions collection
+    if _looks_like_jwt(token):
+        payload = _decode_access_token(token)
+        if payload is not None:
+            return await _load_access_token_principal(payload, db)
+    
     # Check if it's a session token from database
     session = await db.user_sessions.find_one(
         {"session_token": token},
         {"_id": 0}
     )
     
-    if session:
-        # Verify session expiry
-        expires_at = session.get("expires_at")
-        if isinstance(expires_at, str):
-            expires_at = datetime.fromisoformat(expires_at)
-        if not expires_at.tzinfo:
-            expires_at = expires_at.replace(tzinfo=timezone.utc)
-        
-        if expires_at < datetime.now(timezone.utc):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Session expired"
-            )
-        
-        # Get user from database
-        user = await db.users.find_one(
-            {"user_id": session["user_id"]},
-            {"_id": 0}
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token"
         )
-        
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found"
-            )
-        
-        return user
     
-    # Try JWT token
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token"
-            )
-    except JWTError:
+    # Verify session expiry; the TTL index removes expired sessions only about once a minute
+    expires_at = session.get("expires_at")
+    # Sessions written before convert_timestamps store an ISO string
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    if not expires_at.tzinfo:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    
+    if expires_at < datetime.now(timezone.utc):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Session expired"
+        )
+    
+    # Get user from database
+    user = await db.users.find_one(
+        {"user_id": session["user_id"]},
+        {"_id": 0}
+    )
+    
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found"
+        )
+    
+    return user, expires_at
+
+
+async def _load_access_token_principal(payload: dict, db):
+    user_id: str = payload.get("sub")
+    if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token"
         )
     
+    await _refresh_revocations(db)
+    if payload.get("jti") in _revoked_jtis:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token revoked"
+        )
+    
     user = await db.users.find_one(
         {"user_id": user_id},
         {"_id": 0}
@@ -111,7 +355,7 @@ async def get_current_user(request: Request, db):
             detail="User not found"
         )
     
-    return user
+    return user, datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
 
 
 async def require_role(user: dict, allowed_roles: list):
@@ -122,18 +366,30 @@ async def require_role(user: dict, allowed_roles: list):
         )
 
 
-async def exchange_session_id_for_token(session_id: str):
+async def exchange_session_id_for_token(session_id: str, url: str = EMERGENT_SESSION_DATA_URL):
     """Exchange Emergent Auth session_id for user data and session_token"""
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id}
-            ) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    return None
-        except Exception as e:
-            print(f"Error exchanging session: {e}")
-            return None
+    cached = session_exchange_cache.get(session_id)
+    if cached is not None:
+        return cached
+    
+    user_data = await _fetch_session_data(session_id, url)
+    
+    # Only successful exchanges are cached; failures may be transient
+    if user_data:
+        session_exchange_cache.set(session_id, user_data)
+    
+    return user_data
+
+
+@coalesce("session_exchange", key=lambda session_id, url: (session_id, url))
+async def _fetch_session_data(session_id: str, url: str):
+    session = await http_client.session()
+    try:
+        async with session.get(url, headers={"X-Session-ID": session_id}) as response:
+            if response.status == 200:
+                return await response.json()
+            else:
+                return None
+    except Exception as e:
+        logger.error(f"Error exchanging session: {e}")
+        return None
@@ -0,0 +1,176 @@
+"""Content-addressed blob store on top of ``storage``.
+
+Uploaded bytes are stored once per SHA-256 under ``blobs/<aa>/<sha256>``;
+``blobs`` documents count how many receipts and documents reference each
+one. Uploading a file that already exists only bumps the reference count.
+
+``collect_garbage`` (``python blobs.py gc``) deletes blobs that have had no
+references for longer than ``BLOB_GC_GRACE_SECONDS``. It first claims a blob
+by setting ``state: "deleting"`` (conditional on it still being
+unreferenced), re-checks the count against ``receipts`` and ``documents``,
+then deletes the bytes and finally the record. ``store_blob`` never takes a
+reference to a blob being deleted; it waits for the record to go and stores
+the bytes afresh.
+"""
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, UploadFile, status
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import logging
+import os
+
+from storage import StoredFile
+
+logger = logging.getLogger(__name__)
+
+BLOB_GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", str(24 * 60 * 60)))
+# A claim older than this belongs to a GC run that died; the next run takes it over
+BLOB_DELETE_LEASE_SECONDS = 10 * 60
+# How long an upload waits for GC to finish deleting the same content
+BLOB_DELETE_WAIT_SECONDS = 10
+BLOB_DELETE_POLL_SECONDS = 0.2
+
+REFERENCING_COLLECTIONS = ("receipts", "documents")
+
+
+def blob_key(sha256: str) -> str:
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+
+async def store_blob(db, storage, upload: UploadFile) -> StoredFile:
+    """Store an upload and take one reference to its blob."""
+    staged = await storage.stage(upload)
+    key = blob_key(staged.sha256)
+    now = datetime.now(timezone.utc)
+
+    deadline = asyncio.get_running_loop().time() + BLOB_DELETE_WAIT_SECONDS
+    while True:
+        try:
+            previous = await db.blobs.find_one_and_update(
+                # A blob being deleted doesn't match, so the upsert collides with it
+                {"sha256": staged.sha256, "state": {"$ne": "deleting"}},
+                {
+                    "$inc": {"ref_count": 1},
+                    "$set": {"last_referenced_at": now},
+                    "$setOnInsert": {
+                        "sha256": staged.sha256,
+                        "storage_key": key,
+                        "size": staged.size,
+                        "content_type": staged.content_type,
+                        "created_at": now
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            break
+        except DuplicateKeyError:
+            # GC is deleting this content; wait for it to remove the record
+            if asyncio.get_running_loop().time() >= deadline:
+                await storage.discard(staged)
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="File storage busy, please try again"
+                )
+            await asyncio.sleep(BLOB_DELETE_POLL_SECONDS)
+
+    # Duplicate content: the bytes are already stored, keep metadata only
+    if previous is not None and await storage.exists(key):
+        await storage.discard(staged)
+    else:
+        await storage.commit(staged, key)
+
+    return staged.model_copy(update={"key": key})
+
+
+async def release_blob(db, sha256: str):
+    """Drop one reference; the blob is reclaimed by GC once unreferenced."""
+    await db.blobs.update_one(
+        {"sha256": sha256},
+        {
+            "$inc": {"ref_count": -1},
+            "$set": {"last_referenced_at": datetime.now(timezone.utc)}
+        }
+    )
+
+
+async def collect_garbage(db, storage, grace_seconds: int = BLOB_GC_GRACE_SECONDS) -> dict:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    reclaimed = 0
+    reclaimed_bytes = 0
+    repaired = 0
+
+    candidates = db.blobs.find(
+        {"ref_count": {"$lte": 0}, "last_referenced_at": {"$lt": cutoff}},
+        {"_id": 0}
+    )
+
+    async for blob in candidates:
+        now = datetime.now(timezone.utc)
+        # Claim first: from here on store_blob won't take a reference to it
+        claimed = await db.blobs.find_one_and_update(
+            {
+                "sha256": blob["sha256"],
+                "ref_count": {"$lte": 0},
+                "last_referenced_at": blob["last_referenced_at"],
+                "$or": [
+                    {"state": {"$ne": "deleting"}},
+                    {"deleting_since": {"$lt": now - timedelta(seconds=BLOB_DELETE_LEASE_SECONDS)}}
+                ]
+            },
+            {"$set": {"state": "deleting", "deleting_since": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if claimed is None:
+            continue
+
+        references = 0
+        for collection in REFERENCING_COLLECTIONS:
+            references += await db[collection].count_documents({"sha256": blob["sha256"]})
+
+        if references:
+            # The counter drifted; trust the referencing documents
+            await db.blobs.update_one(
+                {"sha256": blob["sha256"], "state": "deleting"},
+                {"$set": {"ref_count": references}, "$unset": {"state": "", "deleting_since": ""}}
+            )
+            repaired += 1
+            continue
+
+        await storage.delete(claimed["storage_key"])
+        for key in claimed.get("derivatives", {}).values():
+            await storage.delete(key)
+        # The record goes last, so uploads waiting on it store the bytes afresh
+        await db.blobs.delete_one({"sha256": blob["sha256"], "state": "deleting"})
+        reclaimed += 1
+        reclaimed_bytes += claimed.get("size", 0)
+
+    logger.info(f"Blob GC reclaimed {reclaimed} blobs ({reclaimed_bytes} bytes), repaired {repaired}")
+    return {"reclaimed": reclaimed, "reclaimed_bytes": reclaimed_bytes, "repaired": repaired}
+
+
+if __name__ == "__main__":
+    import asyncio
+    import json
+    import sys
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+
+    from storage import create_storage
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+        try:
+            print(json.dumps(await collect_garbage(db, create_storage())))
+        finally:
+            client.close()
+
+    if sys.argv[1:] != ["gc"]:
+        sys.exit("usage: python blobs.py gc")
+    asyncio.run(main())
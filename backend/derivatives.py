@@ -0,0 +1,213 @@
+"""Thumbnails and first-page previews for uploaded receipts and documents.
+
+Rendering is CPU-bound, so it runs in a ``ProcessPoolExecutor`` and never on
+the event loop; ``DERIVATIVE_CONCURRENCY`` bounds how many renders (and
+originals held in memory) are in flight at once: a slot is taken before the
+original is read. Uploads schedule ``generate_derivatives`` as a background
+task after the response is sent.
+
+Derivatives belong to a blob, so duplicate uploads share them: they are
+stored as ``derivatives/<aa>/<sha256>/<variant>.jpg`` and recorded on the
+``blobs`` document. Once they exist, every receipt and document with that
+hash gets ``thumbnail_url`` and ``preview_url``. A render claims the blob
+with ``derivatives_status: "pending"`` for ``DERIVATIVE_LEASE_SECONDS``; if
+the process dies mid-render, the next upload of the file takes the claim over.
+
+Images need Pillow and PDFs additionally need pypdfium2. Both are optional;
+without them uploads simply have no derivatives.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+import asyncio
+import importlib.util
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+DERIVATIVE_CONCURRENCY = int(os.getenv("DERIVATIVE_CONCURRENCY", str(DERIVATIVE_WORKERS)))
+DERIVATIVE_LEASE_SECONDS = int(os.getenv("DERIVATIVE_LEASE_SECONDS", "300"))
+
+# Longest edge in pixels
+VARIANTS = {
+    "thumbnail": int(os.getenv("THUMBNAIL_SIZE", "256")),
+    "preview": int(os.getenv("PREVIEW_SIZE", "1024")),
+}
+
+PDF_CONTENT_TYPE = "application/pdf"
+
+HAS_PILLOW = importlib.util.find_spec("PIL") is not None
+HAS_PDFIUM = importlib.util.find_spec("pypdfium2") is not None
+
+# URL prefix per referencing collection; the id field completes the path
+REFERENCES = {
+    "receipts": ("receipt_id", "/api/receipts/"),
+    "documents": ("document_id", "/api/documents/"),
+}
+
+
+def derivative_key(sha256: str, variant: str) -> str:
+    return f"derivatives/{sha256[:2]}/{sha256}/{variant}.jpg"
+
+
+def supports(content_type: Optional[str]) -> bool:
+    if not HAS_PILLOW or not content_type:
+        return False
+    if content_type == PDF_CONTENT_TYPE:
+        return HAS_PDFIUM
+    return content_type.startswith("image/")
+
+
+def render_derivatives(data: bytes, content_type: str) -> Dict[str, bytes]:
+    """Render every variant as JPEG. Runs in a worker process."""
+    from PIL import Image, ImageOps
+
+    largest = max(VARIANTS.values())
+
+    if content_type == PDF_CONTENT_TYPE:
+        import pypdfium2 as pdfium
+
+        pdf = pdfium.PdfDocument(data)
+        try:
+            page = pdf[0]
+            width, height = page.get_size()
+            # Render straight at the largest size we need, not at full resolution
+            image = page.render(scale=largest / max(width, height)).to_pil()
+        finally:
+            pdf.close()
+    else:
+        image = Image.open(io.BytesIO(data))
+        # Lets the JPEG decoder downscale while decoding large phone photos
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+
+    image = image.convert("RGB")
+    rendered = {}
+    for variant, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=80, optimize=True)
+        rendered[variant] = buffer.getvalue()
+
+    return rendered
+
+
+class DerivativePipeline:
+    def __init__(self, workers: int = DERIVATIVE_WORKERS, concurrency: int = DERIVATIVE_CONCURRENCY):
+        self.workers = workers
+        self._executor = None
+        self._slots = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.active = 0
+        self.waiting = 0
+        self.rendered = 0
+        self.failed = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def render(self, storage, stored) -> Dict[str, bytes]:
+        """Read the original and render it, holding a slot for both."""
+        self.waiting += 1
+        async with self._slots:
+            self.waiting -= 1
+            self.active += 1
+            try:
+                data = b"".join([
+                    chunk async for chunk in storage.iter_range(stored.key, 0, stored.size - 1)
+                ])
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool(), render_derivatives, data, stored.content_type)
+            finally:
+                self.active -= 1
+
+    async def generate(self, db, storage, stored) -> bool:
+        """Make sure the blob behind ``stored`` has derivatives and link them.
+
+        Returns True if any receipt or document gained derivative URLs.
+        """
+        if not supports(stored.content_type) or stored.size == 0:
+            return False
+
+        # Claim the blob so concurrent uploads of the same file render it once;
+        # a claim whose lease ran out belongs to a render that never finished
+        now = datetime.now(timezone.utc)
+        claimed = await db.blobs.update_one(
+            {"sha256": stored.sha256, "$or": [
+                {"derivatives_status": {"$exists": False}},
+                {"derivatives_status": "pending", "derivatives_claimed_at": {
+                    "$not": {"$gte": now - timedelta(seconds=DERIVATIVE_LEASE_SECONDS)}
+                }}
+            ]},
+            {"$set": {"derivatives_status": "pending", "derivatives_claimed_at": now}}
+        )
+
+        if claimed.modified_count:
+            try:
+                rendered = await self.render(storage, stored)
+                keys = {}
+                for variant, image in rendered.items():
+                    keys[variant] = derivative_key(stored.sha256, variant)
+                    await storage.put(keys[variant], image, "image/jpeg")
+            except Exception as e:
+                logger.warning(f"Rendering derivatives for {stored.sha256} failed: {e}")
+                self.failed += 1
+                await db.blobs.update_one(
+                    {"sha256": stored.sha256, "derivatives_claimed_at": now},
+                    {"$set": {"derivatives_status": "failed"}}
+                )
+                return False
+
+            self.rendered += 1
+            await db.blobs.update_one(
+                {"sha256": stored.sha256},
+                {"$set": {"derivatives_status": "ready", "derivatives": keys}}
+            )
+        else:
+            blob = await db.blobs.find_one(
+                {"sha256": stored.sha256}, {"_id": 0, "derivatives_status": 1}
+            )
+            # Still pending: the task that claimed it links this upload too
+            if not blob or blob.get("derivatives_status") != "ready":
+                return False
+
+        return await link_derivatives(db, stored.sha256)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "available": HAS_PILLOW,
+            "pdf_available": HAS_PILLOW and HAS_PDFIUM,
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rendered": self.rendered,
+            "failed": self.failed,
+        }
+
+
+async def link_derivatives(db, sha256: str) -> bool:
+    linked = 0
+    for collection, (id_field, prefix) in REFERENCES.items():
+        result = await db[collection].update_many(
+            {"sha256": sha256, "thumbnail_url": {"$exists": False}},
+            [{"$set": {
+                variant + "_url": {"$concat": [prefix, f"${id_field}", f"/{variant}"]}
+                for variant in VARIANTS
+            }}]
+        )
+        linked += result.modified_count
+    return linked > 0
+
+
+derivative_pipeline = DerivativePipeline()
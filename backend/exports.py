@@ -0,0 +1,122 @@
+"""Streaming NDJSON / CSV exports of admin data.
+
+Rows are read from a Motor cursor in ``(created_at, id)`` order and written
+out in small chunks as they arrive, so memory use stays flat however large
+the export. Every row carries a ``_cursor`` resume token; pass the last one
+received as ``cursor`` to continue an interrupted export from the next row.
+
+CSV cells that a spreadsheet would evaluate as a formula are prefixed with
+``'`` so user-supplied names and notes export as plain text.
+"""
+from datetime import datetime
+from enum import Enum
+from pymongo import ASCENDING
+from typing import AsyncIterator, Optional
+import csv
+import io
+import json
+
+from pagination import after_cursor, encode_cursor
+
+EXPORT_BATCH_SIZE = 500
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# Flush the output once a chunk reaches this many bytes
+CHUNK_BYTES = 64 * 1024
+
+
+class ExportSpec:
+    def __init__(self, collection: str, id_field: str, columns: list, filters: dict):
+        self.collection = collection
+        self.id_field = id_field
+        self.columns = columns
+        # query parameter -> document field
+        self.filters = filters
+
+
+EXPORTS = {
+    "users": ExportSpec(
+        "users", "user_id",
+        ["user_id", "email", "name", "role", "unit_number", "phone", "created_at", "updated_at"],
+        {"role": "role"}
+    ),
+    "payments": ExportSpec(
+        "payments", "payment_id",
+        ["payment_id", "user_id", "amount", "payment_method", "status", "transaction_id",
+         "description", "created_at", "updated_at"],
+        {"status": "status", "method": "payment_method", "user_id": "user_id"}
+    ),
+    "receipts": ExportSpec(
+        "receipts", "receipt_id",
+        ["receipt_id", "payment_id", "user_id", "file_name", "file_size", "content_type",
+         "sha256", "notes", "created_at"],
+        {"user_id": "user_id", "payment_id": "payment_id"}
+    ),
+    "rsvps": ExportSpec(
+        "event_rsvps", "rsvp_id",
+        ["rsvp_id", "event_id", "user_id", "status", "created_at"],
+        {"status": "status", "event_id": "event_id", "user_id": "user_id"}
+    ),
+}
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _csv_safe(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def build_query(spec: ExportSpec, filters: dict, since: Optional[datetime], until: Optional[datetime],
+                cursor: Optional[str]) -> dict:
+    query = {spec.filters[name]: value for name, value in filters.items() if value is not None}
+
+    created = {}
+    if since:
+        created["$gte"] = since
+    if until:
+        created["$lt"] = until
+    if created:
+        query["created_at"] = created
+
+    if cursor:
+        query = {"$and": [query, after_cursor(cursor, "created_at", spec.id_field, descending=False)]}
+
+    return query
+
+
+async def stream_export(db, spec: ExportSpec, query: dict, fmt: str) -> AsyncIterator[str]:
+    rows = db[spec.collection].find(
+        query, {"_id": 0, **{column: 1 for column in spec.columns}}
+    ).sort([("created_at", ASCENDING), (spec.id_field, ASCENDING)]).batch_size(EXPORT_BATCH_SIZE)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(spec.columns + ["_cursor"])
+
+    async for doc in rows:
+        resume = encode_cursor([doc.get("created_at"), doc.get(spec.id_field)])
+        if writer:
+            writer.writerow([_csv_safe(_plain(doc.get(column))) for column in spec.columns] + [resume])
+        else:
+            row = {column: _plain(doc.get(column)) for column in spec.columns}
+            row["_cursor"] = resume
+            buffer.write(json.dumps(row, separators=(",", ":")) + "\n")
+
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
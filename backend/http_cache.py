@@ -0,0 +1,134 @@
+"""Conditional GET support for read endpoints.
+
+Write handlers call ``bump_version`` for the collections they change. Read
+handlers call ``conditional_get`` before querying: the per-collection version
+stamps (one indexed point read) determine a strong ETag and Last-Modified for
+the response, and a matching ``If-None-Match`` / ``If-Modified-Since``
+short-circuits with ``304 Not Modified`` without running the list query.
+
+A write can also bump tags within a collection (e.g. one document category).
+``conditional_get`` leaves the stamps on ``request.state``, and
+``version_key`` turns them into a version for response cache keys, so an
+upload to one category doesn't change the keys of the others.
+"""
+from fastapi import Request, Response
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pymongo import ReturnDocument
+from typing import List, Optional
+import hashlib
+
+from singleflight import coalesce
+
+PUBLIC_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+
+
+def _tag_id(tag: str) -> str:
+    # Tags can carry user input (categories); hash them into safe field names
+    return hashlib.sha256(tag.encode()).hexdigest()[:16]
+
+
+async def bump_version(db, collection: str, *tags: str):
+    """Mark ``collection`` (and ``tags`` within it) as changed; invalidates every
+    ETag derived from it."""
+    return await db.collection_versions.find_one_and_update(
+        {"_id": collection},
+        {
+            "$inc": {"version": 1, **{f"tags.{_tag_id(tag)}": 1 for tag in tags}},
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+@coalesce("collection_versions", key=lambda db, collections: tuple(collections))
+async def get_versions(db, collections: List[str]) -> dict:
+    stamps = {name: {"version": 0, "updated_at": None} for name in collections}
+    async for doc in db.collection_versions.find({"_id": {"$in": collections}}):
+        stamps[doc["_id"]] = doc
+    return stamps
+
+
+def version_key(request: Request, *parts) -> str:
+    """Version of the data behind a response, from the stamps ``conditional_get``
+    loaded: each part is a collection name or a ``(collection, tag)`` pair."""
+    stamps = request.state.collection_versions
+    versions = []
+    for part in parts:
+        if isinstance(part, tuple):
+            collection, tag = part
+            tags = stamps[collection].get("tags", {})
+            versions.append(f"{collection}:{tag}:{tags.get(_tag_id(tag), 0)}")
+        else:
+            versions.append(f"{part}:{stamps[part]['version']}")
+    return ",".join(versions)
+
+
+def _etag_for(request: Request, stamps: dict) -> str:
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    versions = ",".join(f"{name}:{stamps[name]['version']}" for name in sorted(stamps))
+    digest = hashlib.sha256(f"{request.url.path}?{query}|{versions}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _last_modified(stamps: dict) -> Optional[datetime]:
+    times = [
+        # Stamps written before convert_timestamps are ISO strings
+        datetime.fromisoformat(stamp["updated_at"]) if isinstance(stamp["updated_at"], str)
+        else stamp["updated_at"]
+        for stamp in stamps.values() if stamp.get("updated_at")
+    ]
+    if not times:
+        return None
+    # tz_aware decoding gives bson's FixedOffset, which format_datetime(usegmt=True)
+    # rejects, so normalize to timezone.utc; HTTP dates have one-second resolution
+    times = [t.astimezone(timezone.utc) if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in times]
+    return max(times).replace(microsecond=0)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+async def conditional_get(
+    request: Request,
+    response: Response,
+    db,
+    collections: List[str],
+    cache_control: str = PUBLIC_CACHE_CONTROL
+) -> Optional[Response]:
+    """Return a 304 response if the client's copy is current, otherwise set the
+    validators on ``response`` and return ``None``."""
+    stamps = await get_versions(db, collections)
+    request.state.collection_versions = stamps
+    etag = _etag_for(request, stamps)
+    last_modified = _last_modified(stamps)
+
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("If-None-Match")
+    if_modified_since = request.headers.get("If-Modified-Since")
+
+    not_modified = False
+    if if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        not_modified = _etag_matches(if_none_match, etag)
+    elif if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            since = None
+        if since is not None:
+            if not since.tzinfo:
+                since = since.replace(tzinfo=timezone.utc)
+            not_modified = last_modified <= since
+
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,296 @@
+"""Index declarations and maintenance for the Barangay Connect collections.
+
+Every query the API issues should be backed by one of the indexes declared in
+``INDEXES``. ``ensure_indexes`` is called at application startup and the
+``audit_indexes`` report is exposed at ``GET /api/admin/indexes`` and through
+the command line:
+
+    python indexes.py ensure
+    python indexes.py audit
+"""
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel(
+            [("created_at", DESCENDING), ("user_id", DESCENDING)],
+            name="created_at_user_id"
+        ),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Mongo deletes sessions once expires_at has passed
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "revoked_tokens": [
+        IndexModel([("jti", ASCENDING)], name="jti_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "payments": [
+        IndexModel([("payment_id", ASCENDING)], name="payment_id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("payment_id", DESCENDING)],
+            name="user_id_created_at_payment_id"
+        ),
+        IndexModel(
+            [("transaction_id", ASCENDING)],
+            name="transaction_id_partial",
+            partialFilterExpression={"transaction_id": {"$type": "string"}}
+        ),
+        IndexModel([("status", ASCENDING)], name="status"),
+        IndexModel([("created_at", ASCENDING), ("payment_id", ASCENDING)], name="created_at_payment_id"),
+    ],
+    "webhook_inbox": [
+        IndexModel([("event_id", ASCENDING)], name="event_id_unique", unique=True),
+        IndexModel(
+            [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+            name="status_next_attempt_at"
+        ),
+        IndexModel([("claimed_by", ASCENDING)], name="claimed_by", sparse=True),
+        IndexModel(
+            [("status", ASCENDING), ("received_at", DESCENDING), ("event_id", DESCENDING)],
+            name="status_received_at_event_id"
+        ),
+    ],
+    "receipts": [
+        IndexModel([("receipt_id", ASCENDING)], name="receipt_id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("receipt_id", DESCENDING)],
+            name="user_id_created_at_receipt_id"
+        ),
+        IndexModel([("created_at", ASCENDING), ("receipt_id", ASCENDING)], name="created_at_receipt_id"),
+        IndexModel([("sha256", ASCENDING)], name="sha256", sparse=True),
+    ],
+    "blobs": [
+        IndexModel([("sha256", ASCENDING)], name="sha256_unique", unique=True),
+        IndexModel(
+            [("ref_count", ASCENDING), ("last_referenced_at", ASCENDING)],
+            name="ref_count_last_referenced_at"
+        ),
+    ],
+    "announcements": [
+        IndexModel([("announcement_id", ASCENDING)], name="announcement_id_unique", unique=True),
+        IndexModel(
+            [("created_at", DESCENDING), ("announcement_id", DESCENDING)],
+            name="created_at_announcement_id"
+        ),
+        IndexModel(
+            [("title", TEXT), ("content", TEXT), ("tags", TEXT)],
+            name="title_content_tags_text",
+            weights={"title": 10, "tags": 5, "content": 1}
+        ),
+    ],
+    "documents": [
+        IndexModel([("document_id", ASCENDING)], name="document_id_unique", unique=True),
+        IndexModel(
+            [("category", ASCENDING), ("created_at", DESCENDING), ("document_id", DESCENDING)],
+            name="category_created_at_document_id"
+        ),
+        IndexModel(
+            [("created_at", DESCENDING), ("document_id", DESCENDING)],
+            name="created_at_document_id"
+        ),
+        IndexModel([("sha256", ASCENDING)], name="sha256", sparse=True),
+        IndexModel(
+            [("title", TEXT), ("description", TEXT), ("file_name", TEXT)],
+            name="title_description_file_name_text",
+            weights={"title": 10, "file_name": 3, "description": 1}
+        ),
+    ],
+    "events": [
+        IndexModel([("event_id", ASCENDING)], name="event_id_unique", unique=True),
+        IndexModel([("event_date", ASCENDING), ("event_id", ASCENDING)], name="event_date_event_id"),
+    ],
+    "event_rsvps": [
+        IndexModel(
+            [("event_id", ASCENDING), ("user_id", ASCENDING)],
+            name="event_id_user_id_unique",
+            unique=True
+        ),
+        IndexModel(
+            [("event_id", ASCENDING), ("status", ASCENDING), ("created_at", ASCENDING), ("rsvp_id", ASCENDING)],
+            name="event_id_status_created_at_rsvp_id"
+        ),
+        IndexModel([("rsvp_id", ASCENDING)], name="rsvp_id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("rsvp_id", ASCENDING)], name="created_at_rsvp_id"),
+    ],
+    "discussions": [
+        IndexModel([("discussion_id", ASCENDING)], name="discussion_id_unique", unique=True),
+        IndexModel(
+            [("category", ASCENDING), ("created_at", DESCENDING), ("discussion_id", DESCENDING)],
+            name="category_created_at_discussion_id"
+        ),
+        IndexModel(
+            [("created_at", DESCENDING), ("discussion_id", DESCENDING)],
+            name="created_at_discussion_id"
+        ),
+        IndexModel(
+            [("title", TEXT), ("content", TEXT)],
+            name="title_content_text",
+            weights={"title": 10, "content": 1}
+        ),
+    ],
+    "discussion_replies": [
+        IndexModel(
+            [("discussion_id", ASCENDING), ("reply_id", ASCENDING)],
+            name="discussion_id_reply_id_unique",
+            unique=True
+        ),
+        IndexModel(
+            [("discussion_id", ASCENDING), ("created_at", ASCENDING), ("reply_id", ASCENDING)],
+            name="discussion_id_created_at_reply_id"
+        ),
+    ],
+    "notifications": [
+        IndexModel([("notification_id", ASCENDING)], name="notification_id_unique", unique=True),
+        IndexModel(
+            [("recipient_id", ASCENDING), ("created_at", DESCENDING), ("notification_id", DESCENDING)],
+            name="recipient_id_created_at_notification_id"
+        ),
+        IndexModel([("batch_id", ASCENDING)], name="batch_id", sparse=True),
+    ],
+    "stream_events": [
+        IndexModel([("seq", ASCENDING)], name="seq_unique", unique=True),
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=24 * 60 * 60),
+    ],
+    "notification_reads": [
+        IndexModel(
+            [("user_id", ASCENDING), ("notification_id", ASCENDING)],
+            name="user_id_notification_id_unique",
+            unique=True
+        ),
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)], name="user_id_seq"),
+    ],
+}
+
+
+def _key_of(spec, weights=None) -> tuple:
+    """Comparable key of an index.
+
+    Mongo lists a text index under ``{"_fts": "text", "_ftsx": 1}`` with the
+    fields in ``weights``, so the text fields of both declared and live
+    indexes collapse into a single ``("$text", weights)`` entry.
+    """
+    key = []
+    for field, direction in spec.items():
+        if direction == TEXT or field in ("_fts", "_ftsx"):
+            if not any(name == "$text" for name, _ in key):
+                key.append(("$text", tuple(sorted((weights or {}).items()))))
+            continue
+        key.append((field, direction))
+    return tuple(key)
+
+
+def _declared_key(document: dict) -> tuple:
+    weights = document.get("weights", {})
+    text_weights = {
+        field: weights.get(field, 1)
+        for field, direction in document["key"].items() if direction == TEXT
+    }
+    return _key_of(document["key"], text_weights)
+
+
+async def ensure_indexes(db):
+    """Create every declared index. Existing indexes are left untouched."""
+    for collection_name, models in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            # Usually an index with the same keys but different options or name,
+            # or a unique index that existing duplicates prevent. Report, don't crash.
+            logger.error(f"Could not create indexes on {collection_name}: {e}")
+
+
+async def audit_indexes(db):
+    """Compare declared indexes with the live ones.
+
+    Returns, per collection, the declared indexes that are missing, live indexes
+    that are not declared or whose keys are a prefix of another index
+    (redundant), indexes with no recorded use since the server started (unused),
+    and the size of every live index in bytes.
+    """
+    report = {}
+
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        declared = {model.document["name"]: _declared_key(model.document) for model in models}
+
+        live = {}
+        async for index in collection.list_indexes():
+            live[index["name"]] = _key_of(index["key"], dict(index.get("weights", {})))
+
+        try:
+            stats = await db.command("collStats", collection_name)
+            sizes = stats.get("indexSizes", {})
+        except OperationFailure:
+            sizes = {}
+
+        usage = {}
+        try:
+            async for entry in collection.aggregate([{"$indexStats": {}}]):
+                usage[entry["name"]] = entry.get("accesses", {}).get("ops", 0)
+        except OperationFailure:
+            pass
+
+        live_keys = set(live.values())
+        missing = [name for name, key in declared.items() if key not in live_keys]
+
+        declared_keys = set(declared.values())
+        undeclared = [
+            name for name, key in live.items()
+            if name != "_id_" and key not in declared_keys
+        ]
+        prefix_of_other = [
+            name for name, key in live.items()
+            if name != "_id_" and any(
+                other != key and other[:len(key)] == key for other in live.values()
+            )
+        ]
+        unused = [
+            name for name in live
+            if name != "_id_" and name in usage and usage[name] == 0
+        ]
+
+        report[collection_name] = {
+            "missing": missing,
+            "redundant": sorted(set(undeclared) | set(prefix_of_other)),
+            "unused": unused,
+            "sizes": {name: sizes.get(name, 0) for name in live},
+        }
+
+    return report
+
+
+if __name__ == "__main__":
+    import asyncio
+    import json
+    import os
+    import sys
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main(command):
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+        try:
+            if command == "ensure":
+                await ensure_indexes(db)
+            print(json.dumps(await audit_indexes(db), indent=2))
+        finally:
+            client.close()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "audit"
+    if command not in ("ensure", "audit"):
+        sys.exit("usage: python indexes.py [ensure|audit]")
+    asyncio.run(main(command))
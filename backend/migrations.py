@@ -0,0 +1,264 @@
+"""One-off data migrations.
+
+Each migration is idempotent and processes documents in batches, so it can be
+re-run after an interruption:
+
+    python migrations.py <name>
+"""
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+import logging
+
+from notifications import backfill_counter
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+async def split_discussion_replies(db, batch_size: int = BATCH_SIZE):
+    """Move replies embedded in ``discussions.replies`` to ``discussion_replies``.
+
+    The parent keeps a denormalized ``reply_count`` and ``last_reply_at``.
+    """
+    migrated = 0
+
+    while True:
+        discussions = await db.discussions.find(
+            {"replies": {"$exists": True}},
+            {"_id": 0, "discussion_id": 1, "replies": 1}
+        ).limit(batch_size).to_list(batch_size)
+
+        if not discussions:
+            break
+
+        for discussion in discussions:
+            discussion_id = discussion["discussion_id"]
+            replies = discussion.get("replies") or []
+
+            if replies:
+                await db.discussion_replies.bulk_write([
+                    UpdateOne(
+                        {"discussion_id": discussion_id, "reply_id": reply["reply_id"]},
+                        {"$setOnInsert": {**reply, "discussion_id": discussion_id}},
+                        upsert=True
+                    )
+                    for reply in replies
+                ], ordered=False)
+
+            # Count from the collection so replies posted since the split are included
+            reply_count = await db.discussion_replies.count_documents(
+                {"discussion_id": discussion_id}
+            )
+            last_reply = await db.discussion_replies.find_one(
+                {"discussion_id": discussion_id},
+                {"_id": 0, "created_at": 1},
+                sort=[("created_at", -1)]
+            )
+
+            await db.discussions.update_one(
+                {"discussion_id": discussion_id},
+                {
+                    "$set": {
+                        "reply_count": reply_count,
+                        "last_reply_at": last_reply["created_at"] if last_reply else None
+                    },
+                    "$unset": {"replies": ""}
+                }
+            )
+            migrated += 1
+
+        logger.info(f"split_discussion_replies: {migrated} discussions migrated")
+
+    return migrated
+
+
+async def split_event_attendees(db, batch_size: int = BATCH_SIZE):
+    """Move ``events.attendees`` arrays to ``event_rsvps`` with seat counters."""
+    migrated = 0
+
+    while True:
+        events = await db.events.find(
+            {"attendees": {"$exists": True}},
+            {"_id": 0, "event_id": 1, "attendees": 1, "created_at": 1}
+        ).limit(batch_size).to_list(batch_size)
+
+        if not events:
+            break
+
+        for event in events:
+            event_id = event["event_id"]
+            attendees = event.get("attendees") or []
+
+            if attendees:
+                # Array order is RSVP order; keep it through the id suffix
+                await db.event_rsvps.bulk_write([
+                    UpdateOne(
+                        {"event_id": event_id, "user_id": user_id},
+                        {"$setOnInsert": {
+                            "rsvp_id": f"rsvp_{event_id}_{position:06d}",
+                            "event_id": event_id,
+                            "user_id": user_id,
+                            "status": "going",
+                            "created_at": event.get("created_at")
+                        }},
+                        upsert=True
+                    )
+                    for position, user_id in enumerate(attendees)
+                ], ordered=False)
+
+            attendee_count = await db.event_rsvps.count_documents(
+                {"event_id": event_id, "status": "going"}
+            )
+            waitlist_count = await db.event_rsvps.count_documents(
+                {"event_id": event_id, "status": "waitlisted"}
+            )
+
+            await db.events.update_one(
+                {"event_id": event_id},
+                {
+                    "$set": {
+                        "attendee_count": attendee_count,
+                        "waitlist_count": waitlist_count
+                    },
+                    "$unset": {"attendees": ""}
+                }
+            )
+            migrated += 1
+
+        logger.info(f"split_event_attendees: {migrated} events migrated")
+
+    return migrated
+
+
+# Fields that older versions stored as ISO strings
+TIMESTAMP_FIELDS = {
+    "users": ["created_at", "updated_at"],
+    "user_sessions": ["created_at", "expires_at"],
+    "payments": ["created_at", "updated_at"],
+    "receipts": ["created_at"],
+    "announcements": ["created_at", "updated_at"],
+    "documents": ["created_at"],
+    "events": ["event_date", "created_at"],
+    "event_rsvps": ["created_at", "updated_at"],
+    "discussions": ["created_at", "updated_at", "last_reply_at"],
+    "discussion_replies": ["created_at"],
+    "notifications": ["created_at"],
+    "notification_reads": ["read_at"],
+    "webhook_inbox": ["received_at", "next_attempt_at", "locked_until", "processed_at"],
+    "blobs": ["created_at", "last_referenced_at"],
+    "collection_versions": ["updated_at"],
+    "analytics_rollups": ["rebuilt_at"],
+}
+
+
+def _parse_timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def convert_timestamps(db, batch_size: int = BATCH_SIZE):
+    """Rewrite ISO-string timestamps as native BSON dates.
+
+    Sorting, range queries and TTL indexes only treat dates as dates; until
+    this has run, string timestamps sort apart from new ones.
+    """
+    converted = 0
+
+    for collection, fields in TIMESTAMP_FIELDS.items():
+        unparseable = []
+
+        while True:
+            docs = await db[collection].find(
+                {
+                    "$or": [{field: {"$type": "string"}} for field in fields],
+                    "_id": {"$nin": unparseable}
+                },
+                {field: 1 for field in fields}
+            ).limit(batch_size).to_list(batch_size)
+
+            if not docs:
+                break
+
+            updates = []
+            for doc in docs:
+                changes = {}
+                for field in fields:
+                    if isinstance(doc.get(field), str):
+                        try:
+                            changes[field] = _parse_timestamp(doc[field])
+                        except ValueError:
+                            logger.warning(f"{collection} {doc['_id']}: cannot parse {field}={doc[field]!r}")
+                if len(changes) < sum(isinstance(doc.get(field), str) for field in fields):
+                    unparseable.append(doc["_id"])
+                if changes:
+                    # Filter on the old values so a concurrent write is not overwritten
+                    updates.append(UpdateOne(
+                        {"_id": doc["_id"], **{field: doc[field] for field in changes}},
+                        {"$set": changes}
+                    ))
+
+            if updates:
+                result = await db[collection].bulk_write(updates, ordered=False)
+                converted += result.modified_count
+
+        logger.info(f"convert_timestamps: {collection} done, {converted} documents converted so far")
+
+    return converted
+
+
+async def create_notification_counters(db, batch_size: int = BATCH_SIZE):
+    """Create ``notification_counters`` for users from before counters existed."""
+    created = 0
+    last_user_id = ""
+
+    while True:
+        users = await db.users.find(
+            {"user_id": {"$gt": last_user_id}},
+            {"_id": 0, "user_id": 1, "created_at": 1}
+        ).sort("user_id", 1).limit(batch_size).to_list(batch_size)
+
+        if not users:
+            break
+
+        for user in users:
+            if await backfill_counter(db, user):
+                created += 1
+        last_user_id = users[-1]["user_id"]
+
+        logger.info(f"create_notification_counters: {created} counters created")
+
+    return created
+
+
+MIGRATIONS = {
+    "split_discussion_replies": split_discussion_replies,
+    "split_event_attendees": split_event_attendees,
+    "convert_timestamps": convert_timestamps,
+    "create_notification_counters": create_notification_counters,
+}
+
+
+if __name__ == "__main__":
+    import asyncio
+    import os
+    import sys
+    from pathlib import Path
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO)
+
+    async def main(name):
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+        try:
+            result = await MIGRATIONS[name](db)
+            print(f"{name}: {result}")
+        finally:
+            client.close()
+
+    if len(sys.argv) != 2 or sys.argv[1] not in MIGRATIONS:
+        sys.exit(f"usage: python migrations.py [{'|'.join(MIGRATIONS)}]")
+    asyncio.run(main(sys.argv[1]))
@@ -25,6 +25,12 @@ class PaymentMethod(str, Enum):
     PAYPAL = "paypal"
 
 
+class RSVPStatus(str, Enum):
+    PENDING = "pending"
+    GOING = "going"
+    WAITLISTED = "waitlisted"
+
+
 class NotificationType(str, Enum):
     PAYMENT_REMINDER = "payment_reminder"
     PAYMENT_SUCCESS = "payment_success"
@@ -114,6 +120,10 @@ class Receipt(BaseModel):
     file_url: str
     file_name: str
     file_size: int
+    content_type: Optional[str] = None
+    sha256: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
     notes: Optional[str] = None
     created_at: datetime
 
@@ -168,6 +178,10 @@ class Document(BaseModel):
     file_url: str
     file_name: str
     file_size: int
+    content_type: Optional[str] = None
+    sha256: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    preview_url: Optional[str] = None
     description: Optional[str] = None
     uploaded_by: str
     created_at: datetime
@@ -190,11 +204,21 @@ class Event(BaseModel):
     event_date: datetime
     location: Optional[str] = None
     max_attendees: Optional[int] = None
-    attendees: List[str] = []
+    attendee_count: int = 0
+    waitlist_count: int = 0
     created_by: str
     created_at: datetime
 
 
+class EventRSVP(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    rsvp_id: str
+    event_id: str
+    user_id: str
+    status: RSVPStatus
+    created_at: datetime
+
+
 # Discussion Models
 class DiscussionCreate(BaseModel):
     title: str = Field(..., min_length=5, max_length=200)
@@ -208,6 +232,7 @@ class DiscussionReply(BaseModel):
 
 class Reply(BaseModel):
     reply_id: str
+    discussion_id: str
     user_id: str
     user_name: str
     content: str
@@ -222,7 +247,8 @@ class Discussion(BaseModel):
     category: str
     author_id: str
     author_name: str
-    replies: List[Reply] = []
+    reply_count: int = 0
+    last_reply_at: Optional[datetime] = None
     created_at: datetime
     updated_at: datetime
 
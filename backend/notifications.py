@@ -0,0 +1,266 @@
+"""Notification delivery.
+
+Broadcasts (``recipient_ids=None``) are stored once with ``recipient_id``
+``"*"`` and fanned out on read: a resident's feed is their own notifications
+merged with broadcasts sent since they joined, and reading a broadcast adds a
+small ``notification_reads`` entry instead of touching a per-user copy.
+Targeted sends are fanned out on write with batched ``insert_many``.
+
+Feeds are keyset-paginated over the ``recipient_id_created_at_notification_id``
+index, so listing and marking as read cost O(page) whatever the number of
+residents.
+
+Unread counts come from one ``notification_counters`` document per user:
+``unread`` counts targeted notifications and is adjusted with ``$inc`` by
+whichever write actually flips a ``read`` flag. Broadcasts are numbered
+(``seq``); ``broadcast_watermark`` marks every broadcast up to it as read,
+so "mark all read" is one update however many broadcasts there were.
+
+Counters are created together with the user (``create_counter``), so every
+``$inc`` lands on an existing document; users from before counters existed
+are backfilled with ``python migrations.py create_notification_counters``.
+"""
+from datetime import datetime, timezone
+from pymongo import ReturnDocument, UpdateOne
+from typing import List, Optional
+import logging
+import uuid
+
+from models import NotificationCreate
+from pagination import paginate, DEFAULT_PAGE_SIZE
+from pubsub import hub, user_channel, PUBLIC_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+BROADCAST = "*"
+FANOUT_BATCH_SIZE = 1000
+
+
+def _feed_query(user: dict) -> dict:
+    broadcasts = {"recipient_id": BROADCAST}
+    # New residents don't inherit the broadcast history from before they joined
+    if user.get("created_at"):
+        broadcasts["created_at"] = {"$gte": user["created_at"]}
+
+    return {"$or": [{"recipient_id": user["user_id"]}, broadcasts]}
+
+
+async def send_notification(db, notification: NotificationCreate, sender_id: Optional[str] = None) -> dict:
+    """Store a notification; returns the stored fields and how many documents were written."""
+    now = datetime.now(timezone.utc)
+    base = {
+        "title": notification.title,
+        "message": notification.message,
+        "notification_type": notification.notification_type,
+        "sender_id": sender_id,
+        "created_at": now
+    }
+
+    if notification.recipient_ids is None:
+        counter = await db.counters.find_one_and_update(
+            {"_id": "broadcasts"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        doc = {
+            **base,
+            "notification_id": f"notif_{uuid.uuid4().hex[:12]}",
+            "recipient_id": BROADCAST,
+            "seq": counter["seq"]
+        }
+        await db.notifications.insert_one(doc)
+        doc.pop("_id", None)
+        await hub.publish([PUBLIC_CHANNEL], "notification", doc)
+        return {"notification": doc, "documents_written": 1}
+
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    # dict.fromkeys drops duplicate recipients but keeps their order
+    recipients: List[str] = list(dict.fromkeys(notification.recipient_ids))
+
+    for start in range(0, len(recipients), FANOUT_BATCH_SIZE):
+        await db.notifications.insert_many([
+            {
+                **base,
+                "notification_id": f"notif_{uuid.uuid4().hex[:12]}",
+                "batch_id": batch_id,
+                "recipient_id": recipient_id,
+                "read": False
+            }
+            for recipient_id in recipients[start:start + FANOUT_BATCH_SIZE]
+        ], ordered=False)
+        await db.notification_counters.bulk_write([
+            UpdateOne({"_id": recipient_id}, {"$inc": {"unread": 1}})
+            for recipient_id in recipients[start:start + FANOUT_BATCH_SIZE]
+        ], ordered=False)
+        # One push message per batch rather than per recipient
+        await hub.publish(
+            [user_channel(r) for r in recipients[start:start + FANOUT_BATCH_SIZE]],
+            "notification", {**base, "batch_id": batch_id}
+        )
+
+    return {"notification": {**base, "batch_id": batch_id}, "documents_written": len(recipients)}
+
+
+async def _broadcast_seq(db) -> int:
+    counter = await db.counters.find_one({"_id": "broadcasts"})
+    return counter["seq"] if counter else 0
+
+
+async def create_counter(db, user: dict):
+    """Create ``user``'s counter; called when the user is created.
+
+    A new user has no targeted notifications, and broadcasts from before they
+    joined are not in their feed, so everything up to the current ``seq`` is read.
+    """
+    await db.notification_counters.update_one(
+        {"_id": user["user_id"]},
+        {"$setOnInsert": {"unread": 0, "broadcast_watermark": await _broadcast_seq(db)}},
+        upsert=True
+    )
+
+
+async def backfill_counter(db, user: dict) -> bool:
+    """Create the counter of a user from before counters existed, from their feed."""
+    if await db.notification_counters.count_documents({"_id": user["user_id"]}, limit=1):
+        return False
+
+    # Broadcasts from before the user joined are not in their feed: treat them as read
+    watermark = 0
+    if user.get("created_at"):
+        last_before_join = await db.notifications.find_one(
+            {"recipient_id": BROADCAST, "created_at": {"$lt": user["created_at"]}},
+            {"_id": 0, "seq": 1},
+            sort=[("created_at", -1)]
+        )
+        watermark = (last_before_join or {}).get("seq", 0)
+
+    unread = await db.notifications.count_documents(
+        {"recipient_id": user["user_id"], "read": False}
+    )
+    result = await db.notification_counters.update_one(
+        {"_id": user["user_id"]},
+        {"$setOnInsert": {"unread": unread, "broadcast_watermark": watermark}},
+        upsert=True
+    )
+    return result.upserted_id is not None
+
+
+async def get_counter(db, user: dict) -> dict:
+    counter = await db.notification_counters.find_one({"_id": user["user_id"]})
+    if counter is None:
+        # Only users from before counters existed; migrations.py backfills them
+        logger.warning(f"No notification counter for {user['user_id']}; run create_notification_counters")
+        return {"_id": user["user_id"], "unread": 0, "broadcast_watermark": 0}
+    return counter
+
+
+async def unread_count(db, user: dict) -> int:
+    counter = await get_counter(db, user)
+    watermark = counter["broadcast_watermark"]
+
+    broadcasts = await _broadcast_seq(db) - watermark
+    if broadcasts > 0:
+        # Only reads newer than the watermark remain, so this stays small
+        broadcasts -= await db.notification_reads.count_documents(
+            {"user_id": user["user_id"], "seq": {"$gt": watermark}}
+        )
+
+    return max(counter.get("unread", 0), 0) + max(broadcasts, 0)
+
+
+async def list_notifications(
+    db, user: dict, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+):
+    """One page of ``user``'s feed; returns ``(notifications, next_cursor)``."""
+    notifications, next_cursor = await paginate(
+        db.notifications, _feed_query(user), "created_at", "notification_id", limit, cursor
+    )
+
+    broadcasts = [n for n in notifications if n["recipient_id"] == BROADCAST]
+    read_ids = set()
+    watermark = 0
+    if broadcasts:
+        watermark = (await get_counter(db, user))["broadcast_watermark"]
+        async for read in db.notification_reads.find(
+            {"user_id": user["user_id"], "notification_id": {"$in": [n["notification_id"] for n in broadcasts]}},
+            {"_id": 0, "notification_id": 1}
+        ):
+            read_ids.add(read["notification_id"])
+
+    for notification in broadcasts:
+        notification["read"] = (
+            notification.get("seq", 0) <= watermark or notification["notification_id"] in read_ids
+        )
+        notification["recipient_id"] = user["user_id"]
+
+    return notifications, next_cursor
+
+
+async def mark_read(db, user: dict, notification_id: str) -> bool:
+    """Mark one notification read for ``user``; False if it is not in their feed."""
+    result = await db.notifications.update_one(
+        {"notification_id": notification_id, "recipient_id": user["user_id"], "read": False},
+        {"$set": {"read": True}}
+    )
+    if result.modified_count:
+        # Only the write that flipped the flag adjusts the counter
+        await db.notification_counters.update_one({"_id": user["user_id"]}, {"$inc": {"unread": -1}})
+        return True
+
+    if await db.notifications.count_documents(
+        {"notification_id": notification_id, "recipient_id": user["user_id"]}, limit=1
+    ):
+        return True
+
+    broadcast = await db.notifications.find_one(
+        {"notification_id": notification_id, "recipient_id": BROADCAST},
+        {"_id": 0, "notification_id": 1, "seq": 1}
+    )
+    if not broadcast:
+        return False
+
+    counter = await get_counter(db, user)
+    if broadcast.get("seq", 0) > counter["broadcast_watermark"]:
+        await db.notification_reads.update_one(
+            {"user_id": user["user_id"], "notification_id": notification_id},
+            {"$setOnInsert": {
+                "seq": broadcast.get("seq", 0),
+                "read_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+    return True
+
+
+async def mark_all_read(db, user: dict, before: Optional[datetime] = None) -> int:
+    """Mark the feed read up to ``before`` (default: now).
+
+    Returns how many targeted notifications changed; broadcasts are covered
+    by moving the watermark.
+    """
+    targeted = {"recipient_id": user["user_id"], "read": False}
+    broadcasts = {"recipient_id": BROADCAST}
+    if before:
+        targeted["created_at"] = {"$lte": before}
+        broadcasts["created_at"] = {"$lte": before}
+
+    result = await db.notifications.update_many(targeted, {"$set": {"read": True}})
+
+    last = await db.notifications.find_one(
+        broadcasts, {"_id": 0, "seq": 1}, sort=[("created_at", -1)]
+    )
+    update = {"$max": {"broadcast_watermark": (last or {}).get("seq", 0)}}
+    if result.modified_count:
+        update["$inc"] = {"unread": -result.modified_count}
+    counter = await db.notification_counters.find_one_and_update(
+        {"_id": user["user_id"]}, update, return_document=ReturnDocument.AFTER
+    )
+
+    # Reads at or below the watermark are implied now
+    if counter is not None:
+        await db.notification_reads.delete_many(
+            {"user_id": user["user_id"], "seq": {"$lte": counter["broadcast_watermark"]}}
+        )
+
+    return result.modified_count
@@ -0,0 +1,99 @@
+"""Keyset (cursor) pagination for list endpoints.
+
+Pages are ordered by ``(sort_field, id_field)`` and the opaque cursor holds the
+last row's pair, so the next page is an index-backed range query instead of a
+``skip`` over everything already returned.
+"""
+from datetime import datetime
+from fastapi import HTTPException, status
+from pymongo import ASCENDING, DESCENDING
+from typing import Optional
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def _encode_value(value):
+    # Dates keep their type through the cursor so range queries compare dates
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and list(value) == ["$date"]:
+        return datetime.fromisoformat(value["$date"])
+    # Anything else would reach the query as an operator document or array
+    if value is None or (isinstance(value, (str, int, float)) and not isinstance(value, bool)):
+        return value
+    raise ValueError(f"Unsupported cursor value: {value!r}")
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        decoded = json.loads(raw)
+        values = [_decode_value(v) for v in decoded] if isinstance(decoded, list) else None
+    except (binascii.Error, ValueError, TypeError):
+        values = None
+
+    if not isinstance(values, list) or len(values) != 2:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+    return values
+
+
+def after_cursor(cursor: str, sort_field: str, id_field: str, descending: bool = True) -> dict:
+    """Filter matching the rows that come after ``cursor`` in sort order."""
+    last_value, last_id = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+
+    return {"$or": [
+        {sort_field: {op: last_value}},
+        {sort_field: last_value, id_field: {op: last_id}}
+    ]}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    sort_field: str,
+    id_field: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    descending: bool = True,
+    projection: Optional[dict] = None
+):
+    """Fetch one page; returns ``(documents, next_cursor)``.
+
+    ``next_cursor`` is ``None`` on the last page. One extra row is read to know
+    whether another page exists.
+    """
+    if cursor:
+        range_query = after_cursor(cursor, sort_field, id_field, descending)
+        query = {"$and": [query, range_query]} if query else range_query
+
+    direction = DESCENDING if descending else ASCENDING
+    documents = await collection.find(
+        query,
+        projection if projection is not None else {"_id": 0}
+    ).sort([(sort_field, direction), (id_field, direction)]).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor([last.get(sort_field), last.get(id_field)])
+
+    return documents, next_cursor
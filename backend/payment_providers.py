@@ -0,0 +1,177 @@
+"""Payment provider clients, created once at startup and reused per request.
+
+``payment_providers.start()`` builds one long-lived client per supported
+``PaymentMethod``; handlers look them up with ``payment_providers.get``.
+Methods without a provider (GCash and PayPal for now) fall back to manual
+confirmation with an uploaded receipt.
+
+Set ``PAYMENT_PROVIDER_MODE=fake`` to register ``FakeProvider`` for every
+method instead; it never leaves the process, which is what tests and load
+benchmarks want.
+"""
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from typing import Dict, Optional
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from models import PaymentMethod
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_PROVIDER_TIMEOUT = float(os.getenv("PAYMENT_PROVIDER_TIMEOUT", "15"))
+
+
+class CheckoutResult(BaseModel):
+    session_id: str
+    url: str
+
+
+class WebhookEvent(BaseModel):
+    event_type: str
+    session_id: Optional[str] = None
+    event_id: Optional[str] = None
+    payment_status: Optional[str] = None
+    metadata: dict = {}
+
+
+async def _with_timeout(awaitable, timeout: float):
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Payment provider timed out"
+        )
+
+
+class StripeProvider:
+    """Stripe checkout through emergentintegrations.
+
+    ``StripeCheckout`` is bound to a webhook URL. With ``STRIPE_WEBHOOK_URL``
+    set, one client is built for it and reused; otherwise each call builds a
+    client for the URL derived from the request, and nothing is cached per
+    host, since the Host header is client-controlled.
+    """
+
+    def __init__(self, api_key: str, webhook_url: Optional[str] = None,
+                 timeout: float = PAYMENT_PROVIDER_TIMEOUT):
+        from emergentintegrations.payments.stripe.checkout import (
+            StripeCheckout, CheckoutSessionRequest
+        )
+
+        self._checkout_class = StripeCheckout
+        self._request_class = CheckoutSessionRequest
+        self.api_key = api_key
+        self.timeout = timeout
+        self.webhook_url = webhook_url
+        self._configured_client = (
+            StripeCheckout(api_key=api_key, webhook_url=webhook_url) if webhook_url else None
+        )
+
+    def _client(self, webhook_url: str):
+        if self._configured_client is not None:
+            return self._configured_client
+        return self._checkout_class(api_key=self.api_key, webhook_url=webhook_url)
+
+    async def create_checkout(
+        self, *, amount: float, currency: str, success_url: str, cancel_url: str,
+        webhook_url: str, metadata: dict
+    ) -> CheckoutResult:
+        checkout_request = self._request_class(
+            amount=float(amount),
+            currency=currency,
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata=metadata
+        )
+        session = await _with_timeout(
+            self._client(webhook_url).create_checkout_session(checkout_request),
+            self.timeout
+        )
+        return CheckoutResult(session_id=session.session_id, url=session.url)
+
+    async def handle_webhook(self, body: bytes, signature: str, webhook_url: str) -> WebhookEvent:
+        response = await _with_timeout(
+            self._client(webhook_url).handle_webhook(body, signature),
+            self.timeout
+        )
+        return WebhookEvent(
+            event_type=response.event_type,
+            session_id=getattr(response, "session_id", None),
+            event_id=getattr(response, "event_id", None),
+            payment_status=getattr(response, "payment_status", None),
+            metadata=getattr(response, "metadata", None) or {}
+        )
+
+    async def close(self):
+        self._configured_client = None
+
+
+class FakeProvider:
+    """In-process provider for tests and benchmarks. Webhooks are unsigned JSON:
+    ``{"event_type": ..., "session_id": ..., "event_id": ...}``."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sessions: Dict[str, dict] = {}
+
+    async def create_checkout(
+        self, *, amount: float, currency: str, success_url: str, cancel_url: str,
+        webhook_url: str, metadata: dict
+    ) -> CheckoutResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {"amount": amount, "currency": currency, "metadata": metadata}
+        return CheckoutResult(
+            session_id=session_id,
+            url=success_url.replace("{CHECKOUT_SESSION_ID}", session_id)
+        )
+
+    async def handle_webhook(self, body: bytes, signature: str, webhook_url: str) -> WebhookEvent:
+        try:
+            return WebhookEvent(**json.loads(body))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid fake webhook payload: {e}")
+
+    async def close(self):
+        self.sessions.clear()
+
+
+class PaymentProviderRegistry:
+    def __init__(self):
+        self._providers: Dict[PaymentMethod, object] = {}
+
+    def start(self):
+        mode = os.getenv("PAYMENT_PROVIDER_MODE", "live")
+
+        if mode == "fake":
+            fake = FakeProvider(latency=float(os.getenv("FAKE_PAYMENT_LATENCY", "0")))
+            for method in PaymentMethod:
+                self._providers[method] = fake
+            return
+
+        api_key = os.getenv("STRIPE_API_KEY")
+        if api_key:
+            webhook_url = os.getenv("STRIPE_WEBHOOK_URL")
+            if not webhook_url:
+                logger.warning("STRIPE_WEBHOOK_URL is not set; using the request host for Stripe webhooks")
+            self._providers[PaymentMethod.STRIPE] = StripeProvider(api_key, webhook_url)
+        else:
+            logger.warning("STRIPE_API_KEY is not set; Stripe checkout is disabled")
+
+    def get(self, method: PaymentMethod):
+        return self._providers.get(method)
+
+    async def close(self):
+        for provider in set(self._providers.values()):
+            await provider.close()
+        self._providers.clear()
+
+
+payment_providers = PaymentProviderRegistry()
@@ -0,0 +1,204 @@
+"""In-process pub/sub hub behind the ``GET /api/stream`` server-sent events feed.
+
+Write handlers call ``hub.publish`` with the channels a message is for
+(``public`` or ``user:<user_id>``). The broker hands every message to the hub
+of each server process, which fans it out to its connected subscribers.
+
+- Each subscriber has a bounded queue. A subscriber that falls behind is
+  disconnected instead of buffering without limit; the browser reconnects
+  with ``Last-Event-ID`` and catches up from the replay buffer.
+- The hub keeps the last ``PUBSUB_REPLAY_SIZE`` messages for that resume. A
+  client whose last id is older than the buffer gets a ``reset`` event and
+  should refetch its lists.
+
+``PUBSUB_BACKEND`` selects the broker: ``local`` (default; single process)
+or ``mongo``, which writes messages to ``stream_events`` and delivers them to
+every process through a change stream (requires a replica set).
+"""
+from collections import deque
+from datetime import datetime, timezone
+from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+from typing import Iterable, List, Optional
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "100"))
+PUBSUB_REPLAY_SIZE = int(os.getenv("PUBSUB_REPLAY_SIZE", "1000"))
+HEARTBEAT_SECONDS = float(os.getenv("PUBSUB_HEARTBEAT_SECONDS", "15"))
+
+PUBLIC_CHANNEL = "public"
+
+
+def user_channel(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def format_sse(message: dict) -> str:
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+class Subscription:
+    def __init__(self, channels: Iterable[str]):
+        self.channels = set(channels)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=PUBSUB_QUEUE_SIZE)
+        self.lagging = False
+
+    def wants(self, message: dict) -> bool:
+        return not self.channels.isdisjoint(message["channels"])
+
+    def offer(self, message: dict):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Cut slow consumers loose; they resume from the replay buffer
+            self.lagging = True
+
+
+class LocalBroker:
+    """Delivers within this process only."""
+
+    def __init__(self):
+        self._seq = 0
+
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    async def publish(self, channels: List[str], event: str, data: dict):
+        self._seq += 1
+        self._deliver({"id": self._seq, "channels": channels, "event": event, "data": data})
+
+    async def close(self):
+        pass
+
+
+class MongoChangeStreamBroker:
+    """Delivers to every process through a change stream on ``stream_events``."""
+
+    def __init__(self, db):
+        self.db = db
+        self._task = None
+
+    async def start(self, deliver):
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        resume_token = None
+        while True:
+            try:
+                async with self.db.stream_events.watch(
+                    [{"$match": {"operationType": "insert"}}], resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change["fullDocument"]
+                        self._deliver({
+                            "id": doc["seq"],
+                            "channels": doc["channels"],
+                            "event": doc["event"],
+                            "data": doc["data"]
+                        })
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Stream change stream failed, retrying: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, channels: List[str], event: str, data: dict):
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": "stream_events"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await self.db.stream_events.insert_one({
+            "seq": counter["seq"],
+            "channels": channels,
+            "event": event,
+            "data": data,
+            "created_at": datetime.now(timezone.utc)
+        })
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class PubSubHub:
+    def __init__(self):
+        self.broker = None
+        self._subscribers = set()
+        self._replay = deque(maxlen=PUBSUB_REPLAY_SIZE)
+        self.published = 0
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+    async def start(self, db):
+        backend = os.getenv("PUBSUB_BACKEND", "local")
+        self.broker = MongoChangeStreamBroker(db) if backend == "mongo" else LocalBroker()
+        await self.broker.start(self._deliver)
+
+    async def publish(self, channels: List[str], event: str, data: dict):
+        """Publish to subscribers of any of ``channels``; never fails the caller."""
+        if self.broker is None:
+            return
+        try:
+            await self.broker.publish(channels, event, jsonable_encoder(data))
+            self.published += 1
+        except Exception as e:
+            logger.error(f"Publishing {event} failed: {e}")
+
+    def _deliver(self, message: dict):
+        self._replay.append(message)
+        for subscription in self._subscribers:
+            if not subscription.lagging and subscription.wants(message):
+                subscription.offer(message)
+                self.delivered += 1
+
+    def subscribe(self, channels: Iterable[str], last_event_id: Optional[int] = None) -> Subscription:
+        subscription = Subscription(channels)
+
+        if last_event_id is not None:
+            oldest = self._replay[0]["id"] if self._replay else None
+            if oldest is not None and last_event_id < oldest - 1:
+                # Part of what the client missed is gone; tell it to refetch
+                subscription.offer({"id": last_event_id, "channels": [], "event": "reset", "data": {}})
+            for message in self._replay:
+                if message["id"] > last_event_id and subscription.wants(message):
+                    subscription.offer(message)
+
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+        if subscription.lagging:
+            self.dropped_subscribers += 1
+
+    async def close(self):
+        if self.broker is not None:
+            await self.broker.close()
+            self.broker = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.broker).__name__ if self.broker else None,
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped_subscribers,
+            "replay_buffer": len(self._replay),
+        }
+
+
+hub = PubSubHub()
@@ -0,0 +1,197 @@
+"""Two-tier cache for serialized responses of hot public list endpoints.
+
+Entries are keyed by route path plus the query parameters the route reads,
+and tagged with what they were built from (e.g. ``announcements`` or
+``documents:category:bylaws``). Write handlers call ``invalidate`` with the
+tags they affect.
+
+- The local tier is a small in-process LRU with a short TTL. Invalidations
+  only reach the local tier of the worker that performed the write, so the TTL
+  bounds how stale other workers can be.
+- The optional shared tier (``RESPONSE_CACHE_BACKEND=redis`` with
+  ``RESPONSE_CACHE_REDIS_URL``, or ``memory`` as a bounded in-process
+  stand-in for tests and single-worker runs) is shared by all workers and
+  invalidated everywhere at once.
+"""
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from typing import Iterable, Optional
+import json
+import logging
+import os
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TTL = float(os.getenv("RESPONSE_CACHE_LOCAL_TTL", "5"))
+LOCAL_SIZE = int(os.getenv("RESPONSE_CACHE_LOCAL_SIZE", "512"))
+SHARED_TTL = int(os.getenv("RESPONSE_CACHE_SHARED_TTL", "300"))
+SHARED_SIZE = int(os.getenv("RESPONSE_CACHE_SHARED_SIZE", "4096"))
+MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+
+
+class MemoryBackend:
+    """In-process implementation of the shared tier, for tests and single-worker runs."""
+
+    def __init__(self, maxsize: int = SHARED_SIZE):
+        # Values carry their tags, so expiry and eviction leave nothing behind
+        self._data = TTLCache(maxsize=maxsize, ttl=SHARED_TTL)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        return entry[0] if entry is not None else None
+
+    async def set(self, key: str, value: bytes, ttl: int, tags: Iterable[str]):
+        self._data.set(key, (value, frozenset(tags)), ttl)
+
+    async def invalidate(self, tags: Iterable[str]):
+        tags = set(tags)
+        self._data.invalidate_where(lambda entry: not entry[1].isdisjoint(tags))
+
+    async def close(self):
+        self._data.clear()
+
+
+class RedisBackend:
+    """Shared tier on any Redis-protocol server; tags are kept as Redis sets."""
+
+    def __init__(self, url: str, prefix: str = "respcache:"):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis requires the 'redis' package")
+
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: int, tags: Iterable[str]):
+        pipe = self._redis.pipeline()
+        pipe.set(self.prefix + key, value, ex=ttl)
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            pipe.sadd(tag_key, self.prefix + key)
+            pipe.expire(tag_key, ttl)
+        await pipe.execute()
+
+    async def invalidate(self, tags: Iterable[str]):
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            keys = await self._redis.smembers(tag_key)
+            await self._redis.delete(tag_key, *keys)
+
+    async def close(self):
+        await self._redis.close()
+
+
+class ResponseCache:
+    def __init__(self, shared=None):
+        self.local = TTLCache(maxsize=LOCAL_SIZE, ttl=LOCAL_TTL)
+        self.shared = shared
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key_for(request: Request, params: dict, version: str = "") -> str:
+        """Cache key for ``request``.
+
+        ``params`` are the query parameters the route actually reads, so unknown
+        ones can't mint new entries. ``version`` comes from
+        ``http_cache.version_key`` for the tags the entry is built from: a fill
+        that raced with a write then lands under the old version's key and is
+        never served again, while writes to other tags leave the key alone.
+        """
+        query = "&".join(f"{k}={v}" for k, v in sorted(params.items()) if v is not None)
+        return f"{request.url.path}?{query}#{version}"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry[0]
+
+        if self.shared is None:
+            return None
+
+        try:
+            value = await self.shared.get(key)
+        except Exception as e:
+            logger.warning(f"Shared response cache unavailable: {e}")
+            return None
+
+        if value is None:
+            self.shared_misses += 1
+            return None
+
+        self.shared_hits += 1
+        # Shared values are "<tags>\n<body>" so the local copy stays invalidatable
+        tag_line, body = value.split(b"\n", 1)
+        tags = tuple(tag_line.decode().split(",")) if tag_line else ()
+        self.local.set(key, (body, tags))
+        return body
+
+    async def set(self, key: str, payload, tags: Iterable[str]) -> bytes:
+        body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+        if len(body) > MAX_ENTRY_BYTES:
+            return body
+
+        tags = tuple(tags)
+        self.local.set(key, (body, tags))
+
+        if self.shared is not None:
+            try:
+                value = ",".join(tags).encode() + b"\n" + body
+                await self.shared.set(key, value, SHARED_TTL, tags)
+            except Exception as e:
+                logger.warning(f"Shared response cache unavailable: {e}")
+
+        return body
+
+    async def invalidate(self, *tags: str):
+        self.invalidations += 1
+        self.local.invalidate_where(lambda entry: any(tag in entry[1] for tag in tags))
+
+        if self.shared is not None:
+            try:
+                await self.shared.invalidate(tags)
+            except Exception as e:
+                logger.warning(f"Shared response cache unavailable: {e}")
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.close()
+
+    def stats(self) -> dict:
+        shared_lookups = self.shared_hits + self.shared_misses
+        return {
+            "local": self.local.stats(),
+            "shared": {
+                "backend": type(self.shared).__name__ if self.shared else None,
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "hit_rate": self.shared_hits / shared_lookups if shared_lookups else 0.0,
+            },
+            "invalidations": self.invalidations,
+        }
+
+
+def cached_response(body: bytes, response: Response) -> Response:
+    """Wrap a cached body, keeping headers (ETag etc.) already set on ``response``."""
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def create_response_cache() -> ResponseCache:
+    backend = os.getenv("RESPONSE_CACHE_BACKEND", "none")
+
+    if backend == "redis":
+        shared = RedisBackend(os.environ["RESPONSE_CACHE_REDIS_URL"])
+    elif backend == "memory":
+        shared = MemoryBackend()
+    else:
+        shared = None
+
+    return ResponseCache(shared)
@@ -0,0 +1,121 @@
+"""Full-text search across announcements, discussions and documents.
+
+Each collection has a MongoDB text index (see ``indexes.py``). A search runs
+one ``$text`` aggregation per collection concurrently, each already sorted by
+relevance and limited to one page, and merges them by score. Results page by
+keyset on ``(score, id)``, so later pages never rescan earlier ones.
+"""
+from typing import List, Optional
+import asyncio
+import re
+
+from pagination import after_cursor, encode_cursor
+
+SNIPPET_LENGTH = 160
+
+# type -> (collection, id field, text fields for the snippet, filters it supports)
+SEARCHABLE = {
+    "announcement": ("announcements", "announcement_id", ["content"], {"tag"}),
+    "discussion": ("discussions", "discussion_id", ["content"], {"category"}),
+    "document": ("documents", "document_id", ["description", "file_name"], {"category"}),
+}
+
+RESULT_FIELDS = ["title", "category", "tags", "priority", "author_name", "file_url",
+                 "thumbnail_url", "created_at"]
+
+
+def make_snippet(text: Optional[str], terms: List[str], length: int = SNIPPET_LENGTH) -> str:
+    """Window of ``text`` around the first matching term."""
+    if not text:
+        return ""
+    if len(text) <= length:
+        return text
+
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in terms]
+    hit = min((p for p in positions if p >= 0), default=0)
+    start = max(0, min(hit - length // 4, len(text) - length))
+    snippet = text[start:start + length].strip()
+
+    return ("…" if start > 0 else "") + snippet + ("…" if start + length < len(text) else "")
+
+
+def _search_terms(q: str) -> List[str]:
+    return [term.lower() for term in re.findall(r"\w+", q) if len(term) > 1]
+
+
+async def _search_collection(
+    db, result_type: str, q: str, filters: dict, limit: int, cursor: Optional[str]
+) -> list:
+    collection, id_field, text_fields, _ = SEARCHABLE[result_type]
+
+    pipeline = [
+        {"$match": {"$text": {"$search": q}, **filters}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        pipeline.append({"$match": after_cursor(cursor, "score", id_field)})
+    pipeline += [
+        {"$sort": {"score": -1, id_field: -1}},
+        {"$limit": limit + 1},
+        {"$project": {
+            "_id": 0, "score": 1, id_field: 1,
+            **{field: 1 for field in RESULT_FIELDS + text_fields}
+        }},
+    ]
+
+    terms = _search_terms(q)
+    results = []
+    async for doc in db[collection].aggregate(pipeline):
+        text = next((doc[field] for field in text_fields if doc.get(field)), None)
+        results.append({
+            "type": result_type,
+            "id": doc.pop(id_field),
+            "score": doc.pop("score"),
+            "snippet": make_snippet(text, terms),
+            **{field: doc[field] for field in RESULT_FIELDS if field in doc}
+        })
+    return results
+
+
+async def search(
+    db,
+    q: str,
+    types: Optional[List[str]] = None,
+    category: Optional[str] = None,
+    tag: Optional[str] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> dict:
+    filters = {"category": category, "tag": tag}
+    wanted = {name: value for name, value in filters.items() if value}
+
+    queries = {}
+    for result_type in types or SEARCHABLE:
+        supported = SEARCHABLE[result_type][3]
+        # A filter a type cannot satisfy (e.g. tag on documents) excludes it
+        if not set(wanted) <= supported:
+            continue
+        match = {}
+        if "category" in wanted:
+            match["category"] = category
+        if "tag" in wanted:
+            match["tags"] = tag
+        queries[result_type] = _search_collection(db, result_type, q, match, limit, cursor)
+
+    pages = await asyncio.gather(*queries.values())
+
+    # Ids carry a per-type prefix, so (score, id) orders all types consistently
+    merged = sorted(
+        (result for page in pages for result in page),
+        key=lambda result: (result["score"], result["id"]),
+        reverse=True
+    )
+
+    next_cursor = None
+    if len(merged) > limit:
+        merged = merged[:limit]
+        last = merged[-1]
+        next_cursor = encode_cursor([last["score"], last["id"]])
+
+    return {"results": merged, "next_cursor": next_cursor}
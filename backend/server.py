@@ -1,10 +1,14 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Request, Response, UploadFile, File, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Request, Response, UploadFile, File, BackgroundTasks, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
+import asyncio
 import logging
+import time
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
 import uuid
@@ -16,14 +20,38 @@ from models import (
     Receipt, ReceiptCreate,
     Announcement, AnnouncementCreate, AnnouncementUpdate, AIAnnouncementRequest,
     Document, DocumentCreate,
-    Event, EventCreate,
+    Event, EventCreate, RSVPStatus,
     Discussion, DiscussionCreate, DiscussionReply, Reply,
     Notification, NotificationCreate, NotificationType,
     SessionData
 )
 from auth import (
-    verify_password, get_password_hash, create_access_token,
-    get_current_user, require_role, exchange_session_id_for_token
+    verify_password_async, get_password_hash_async, password_needs_rehash,
+    configure_password_hashing, password_hashing_stats, create_access_token,
+    get_current_user, require_role, exchange_session_id_for_token,
+    invalidate_token, invalidate_user, principal_cache, revoke_access_token
+)
+from indexes import ensure_indexes, audit_indexes
+from pagination import paginate, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from http_cache import conditional_get, bump_version, version_key
+from response_cache import create_response_cache, cached_response
+from singleflight import coalesce, singleflight_stats
+from payment_providers import payment_providers
+from http_client import http_client
+from storage import create_storage, file_response
+from blobs import store_blob, release_blob, collect_garbage
+from derivatives import derivative_pipeline, derivative_key
+from search import search, SEARCHABLE
+from notifications import (
+    send_notification, list_notifications, mark_read, mark_all_read, unread_count,
+    create_counter
+)
+from ai_drafting import create_draft_service
+from exports import EXPORTS, MEDIA_TYPES, build_query, stream_export
+from pubsub import hub, format_sse, user_channel, PUBLIC_CHANNEL, HEARTBEAT_SECONDS
+from webhook_inbox import WebhookInboxWorker, enqueue_webhook_event, retry_dead_event
+from analytics import (
+    record_user_created, record_payment_created, get_rollups, rebuild_rollups
 )
 
 ROOT_DIR = Path(__file__).parent
@@ -31,12 +59,25 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: dates come back as UTC-aware datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app
 app = FastAPI(title="Barangay Connect API")
 
+# Shared cache for hot public list responses
+response_cache = create_response_cache()
+
+# Receipt and document files
+storage = create_storage()
+
+# Rate-limited, cached AI drafting
+draft_service = create_draft_service()
+
+# Applies queued payment webhooks in the background
+webhook_worker = WebhookInboxWorker(db)
+
 # Create API router
 api_router = APIRouter(prefix="/api")
 
@@ -58,7 +99,7 @@ async def register(user_data: UserCreate):
     
     # Create user
     user_id = f"user_{uuid.uuid4().hex[:12]}"
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     
     user_doc = {
         "user_id": user_id,
@@ -69,11 +110,20 @@ async def register(user_data: UserCreate):
         "phone": user_data.phone,
         "picture": user_data.picture,
         "password_hash": hashed_password,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     
-    await db.users.insert_one(user_doc)
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    await create_counter(db, user_doc)
+    await record_user_created(db, user_doc)
     
     # Create access token
     access_token = create_access_token(data={"sub": user_id})
@@ -88,15 +138,21 @@ async def register(user_data: UserCreate):
 
 
 @api_router.post("/auth/login")
-async def login(credentials: UserLogin, response: Response):
+async def login(credentials: UserLogin, response: Response, background_tasks: BackgroundTasks):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
     
-    if not user or not verify_password(credentials.password, user.get("password_hash", "")):
+    if not user or not await verify_password_async(credentials.password, user.get("password_hash", "")):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
+    # Upgrade the stored hash to the current cost after responding
+    if password_needs_rehash(user["password_hash"]):
+        background_tasks.add_task(
+            rehash_password, user["user_id"], user["password_hash"], credentials.password
+        )
+    
     # Create access token
     access_token = create_access_token(data={"sub": user["user_id"]})
     
@@ -105,8 +161,8 @@ async def login(credentials: UserLogin, response: Response):
     session_doc = {
         "user_id": user["user_id"],
         "session_token": session_token,
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
+        "created_at": datetime.now(timezone.utc)
     }
     await db.user_sessions.insert_one(session_doc)
     
@@ -130,6 +186,16 @@ async def login(credentials: UserLogin, response: Response):
     }
 
 
+async def rehash_password(user_id: str, old_hash: str, password: str):
+    new_hash = await get_password_hash_async(password)
+    
+    # Only replace the hash we verified against, never a concurrently changed one
+    await db.users.update_one(
+        {"user_id": user_id, "password_hash": old_hash},
+        {"$set": {"password_hash": new_hash}}
+    )
+
+
 @api_router.post("/auth/google/callback")
 async def google_auth_callback(request: Request, response: Response):
     """REMINDER: DO NOT HARDCODE THE URL, OR ADD ANY FALLBACKS OR REDIRECT URLS, THIS BREAKS THE AUTH"""
@@ -165,11 +231,18 @@ async def google_auth_callback(request: Request, response: Response):
             "role": UserRole.RESIDENT,
             "unit_number": None,
             "phone": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
-        await db.users.insert_one(user_doc)
-        user = user_doc
+        try:
+            await db.users.insert_one(user_doc)
+        except DuplicateKeyError:
+            # A concurrent callback for the same email created the account; log into it
+            user = await db.users.find_one({"email": user_data["email"]}, {"_id": 0})
+        else:
+            await create_counter(db, user_doc)
+            await record_user_created(db, user_doc)
+            user = user_doc
     else:
         # Update user info
         await db.users.update_one(
@@ -177,19 +250,23 @@ async def google_auth_callback(request: Request, response: Response):
             {"$set": {
                 "name": user_data["name"],
                 "picture": user_data.get("picture"),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc)
             }}
         )
+        invalidate_user(user["user_id"])
     
-    # Create session
+    # Create session; a repeated callback for the same login reuses it
     session_token = user_data["session_token"]
-    session_doc = {
-        "user_id": user["user_id"],
-        "session_token": session_token,
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.user_sessions.insert_one(session_doc)
+    await db.user_sessions.update_one(
+        {"session_token": session_token},
+        {"$setOnInsert": {
+            "user_id": user["user_id"],
+            "session_token": session_token,
+            "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
+            "created_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
     
     # Set cookie
     response.set_cookie(
@@ -220,6 +297,12 @@ async def logout(request: Request, response: Response):
     
     if token:
         await db.user_sessions.delete_one({"session_token": token})
+        invalidate_token(token)
+    
+    # Bearer access tokens stay valid until expiry unless revoked
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        await revoke_access_token(auth_header.replace("Bearer ", ""), db)
     
     response.delete_cookie(key="session_token", path="/")
     
@@ -231,12 +314,13 @@ async def update_profile(update_data: UserUpdate, request: Request):
     user = await get_current_user(request, db)
     
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     
     await db.users.update_one(
         {"user_id": user["user_id"]},
         {"$set": update_dict}
     )
+    invalidate_user(user["user_id"])
     
     updated_user = await db.users.find_one(
         {"user_id": user["user_id"]},
@@ -251,9 +335,10 @@ async def update_profile(update_data: UserUpdate, request: Request):
 async def create_payment(payment_data: PaymentCreate, request: Request):
     user = await get_current_user(request, db)
     
-    from emergentintegrations.payments.stripe.checkout import (
-        StripeCheckout, CheckoutSessionRequest
-    )
+    # Methods with a checkout provider redirect to it; the rest are confirmed manually
+    provider = payment_providers.get(payment_data.payment_method)
+    if payment_data.payment_method == PaymentMethod.STRIPE and not provider:
+        raise HTTPException(status_code=503, detail="Stripe is not configured")
     
     payment_id = f"pay_{uuid.uuid4().hex[:12]}"
     
@@ -267,36 +352,32 @@ async def create_payment(payment_data: PaymentCreate, request: Request):
         "transaction_id": None,
         "description": payment_data.description or "HOA Dues Payment",
         "metadata": payment_data.metadata,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.payments.insert_one(payment_doc)
+    await record_payment_created(db, payment_doc)
     
-    # For Stripe payments
-    if payment_data.payment_method == PaymentMethod.STRIPE:
-        api_key = os.getenv("STRIPE_API_KEY")
+    if provider:
         host_url = str(request.base_url).rstrip("/")
         webhook_url = f"{host_url}/api/webhook/stripe"
         
-        stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
-        
         success_url = f"{host_url.replace('/api', '')}/payment-success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = f"{host_url.replace('/api', '')}/payments"
         
-        checkout_request = CheckoutSessionRequest(
-            amount=float(payment_data.amount),
+        session = await provider.create_checkout(
+            amount=payment_data.amount,
             currency="php",
             success_url=success_url,
             cancel_url=cancel_url,
+            webhook_url=webhook_url,
             metadata={
                 "payment_id": payment_id,
                 "user_id": user["user_id"]
             }
         )
         
-        session = await stripe_checkout.create_checkout_session(checkout_request)
-        
         # Update payment with session info
         await db.payments.update_one(
             {"payment_id": payment_id},
@@ -316,15 +397,19 @@ async def create_payment(payment_data: PaymentCreate, request: Request):
 
 
 @api_router.get("/payments")
-async def get_payments(request: Request, limit: int = 50):
+async def get_payments(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     user = await get_current_user(request, db)
     
-    payments = await db.payments.find(
-        {"user_id": user["user_id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
+    payments, next_cursor = await paginate(
+        db.payments, {"user_id": user["user_id"]},
+        "created_at", "payment_id", limit, cursor
+    )
     
-    return {"payments": payments}
+    return {"payments": payments, "next_cursor": next_cursor}
 
 
 @api_router.get("/payments/{payment_id}")
@@ -344,38 +429,56 @@ async def get_payment(payment_id: str, request: Request):
 
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
-    from emergentintegrations.payments.stripe.checkout import StripeCheckout
+    provider = payment_providers.get(PaymentMethod.STRIPE)
+    if not provider:
+        raise HTTPException(status_code=503, detail="Stripe is not configured")
     
-    api_key = os.getenv("STRIPE_API_KEY")
     webhook_url = str(request.base_url).rstrip("/") + "/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
     
     body = await request.body()
     signature = request.headers.get("Stripe-Signature", "")
     
     try:
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        # Update payment status
-        if webhook_response.event_type == "checkout.session.completed":
-            await db.payments.update_one(
-                {"transaction_id": webhook_response.session_id},
-                {"$set": {
-                    "status": PaymentStatus.SUCCESSFUL,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-        
-        return {"status": "success"}
+        webhook_response = await provider.handle_webhook(body, signature, webhook_url)
     except Exception as e:
         logger.error(f"Webhook error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
+    
+    # Persist and ack; the inbox worker applies the update. Retries are no-ops.
+    if await enqueue_webhook_event(db, "stripe", webhook_response, body):
+        webhook_worker.notify()
+    
+    return {"status": "success"}
+
+
+# ==================== FILE DERIVATIVES ====================
+async def generate_derivatives(stored):
+    # Runs after the upload response; rendering happens in worker processes
+    if not await derivative_pipeline.generate(db, storage, stored):
+        return
+    
+    categories = await db.documents.distinct("category", {"sha256": stored.sha256})
+    if categories:
+        await bump_version(db, "documents", *[f"category:{category}" for category in categories])
+        await response_cache.invalidate(
+            "documents:all", *[f"documents:category:{category}" for category in categories]
+        )
+
+
+async def derivative_response(doc: Optional[dict], variant: str, request: Request):
+    if not doc or not doc.get(f"{variant}_url"):
+        raise HTTPException(status_code=404, detail="Preview not available")
+    
+    return await file_response(
+        storage, derivative_key(doc["sha256"], variant), request, f"{variant}.jpg", "image/jpeg"
+    )
 
 
 # ==================== RECEIPT ROUTES ====================
 @api_router.post("/receipts/upload")
 async def upload_receipt(
     payment_id: str,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     notes: Optional[str] = None,
     request: Request = None
@@ -391,37 +494,99 @@ async def upload_receipt(
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
     
-    # In production, upload to cloud storage (S3, etc.)
-    # For now, we'll store file info
     receipt_id = f"receipt_{uuid.uuid4().hex[:12]}"
-    file_url = f"/uploads/receipts/{receipt_id}_{file.filename}"
+    stored = await store_blob(db, storage, file)
     
     receipt_doc = {
         "receipt_id": receipt_id,
         "payment_id": payment_id,
         "user_id": user["user_id"],
-        "file_url": file_url,
+        "file_url": f"/api/receipts/{receipt_id}/file",
         "file_name": file.filename,
-        "file_size": file.size if hasattr(file, 'size') else 0,
+        "file_size": stored.size,
+        "content_type": stored.content_type,
+        "sha256": stored.sha256,
+        "storage_key": stored.key,
         "notes": notes,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.receipts.insert_one(receipt_doc)
+    background_tasks.add_task(generate_derivatives, stored)
     
-    return {"receipt": {k: v for k, v in receipt_doc.items() if k != "_id"}}
+    return {"receipt": {k: v for k, v in receipt_doc.items() if k not in ("_id", "storage_key")}}
 
 
 @api_router.get("/receipts")
-async def get_receipts(request: Request):
+async def get_receipts(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     user = await get_current_user(request, db)
     
-    receipts = await db.receipts.find(
-        {"user_id": user["user_id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+    receipts, next_cursor = await paginate(
+        db.receipts, {"user_id": user["user_id"]},
+        "created_at", "receipt_id", limit, cursor,
+        projection={"_id": 0, "storage_key": 0}
+    )
+    
+    return {"receipts": receipts, "next_cursor": next_cursor}
+
+
+async def get_visible_receipt(receipt_id: str, request: Request) -> dict:
+    user = await get_current_user(request, db)
+    
+    receipt = await db.receipts.find_one({"receipt_id": receipt_id}, {"_id": 0})
+    
+    # Residents see their own receipts; the board reviews everyone's
+    if not receipt or (
+        receipt["user_id"] != user["user_id"]
+        and user.get("role") not in [UserRole.ADMIN, UserRole.BOARD_MEMBER]
+    ):
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    
+    return receipt
+
+
+@api_router.get("/receipts/{receipt_id}/file")
+async def download_receipt(receipt_id: str, request: Request):
+    receipt = await get_visible_receipt(receipt_id, request)
+    
+    if not receipt.get("storage_key"):
+        raise HTTPException(status_code=404, detail="Receipt file not available")
+    
+    return await file_response(
+        storage, receipt["storage_key"], request, receipt["file_name"], receipt.get("content_type")
+    )
+
+
+@api_router.get("/receipts/{receipt_id}/thumbnail")
+async def get_receipt_thumbnail(receipt_id: str, request: Request):
+    return await derivative_response(await get_visible_receipt(receipt_id, request), "thumbnail", request)
+
+
+@api_router.get("/receipts/{receipt_id}/preview")
+async def get_receipt_preview(receipt_id: str, request: Request):
+    return await derivative_response(await get_visible_receipt(receipt_id, request), "preview", request)
+
+
+@api_router.delete("/receipts/{receipt_id}")
+async def delete_receipt(receipt_id: str, request: Request):
+    user = await get_current_user(request, db)
     
-    return {"receipts": receipts}
+    receipt = await db.receipts.find_one_and_delete(
+        {"receipt_id": receipt_id, "user_id": user["user_id"]},
+        {"_id": 0, "sha256": 1}
+    )
+    
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    
+    if receipt.get("sha256"):
+        await release_blob(db, receipt["sha256"])
+    
+    return {"message": "Receipt deleted"}
 
 
 # ==================== ANNOUNCEMENT ROUTES ====================
@@ -440,23 +605,51 @@ async def create_announcement(announcement_data: AnnouncementCreate, request: Re
         "tags": announcement_data.tags,
         "author_id": user["user_id"],
         "author_name": user["name"],
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.announcements.insert_one(announcement_doc)
+    await bump_version(db, "announcements")
+    await response_cache.invalidate("announcements", "search")
+    await hub.publish([PUBLIC_CHANNEL], "announcement", {
+        k: announcement_doc[k] for k in ("announcement_id", "title", "priority", "created_at")
+    })
     
     return {"announcement": {k: v for k, v in announcement_doc.items() if k != "_id"}}
 
 
+@coalesce("announcements", key=lambda cache_key, limit, cursor: cache_key)
+async def load_announcements(cache_key: str, limit: int, cursor: Optional[str]) -> bytes:
+    announcements, next_cursor = await paginate(
+        db.announcements, {}, "created_at", "announcement_id", limit, cursor
+    )
+    return await response_cache.set(
+        cache_key,
+        {"announcements": announcements, "next_cursor": next_cursor},
+        ["announcements"]
+    )
+
+
 @api_router.get("/announcements")
-async def get_announcements(limit: int = 50):
-    announcements = await db.announcements.find(
-        {},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
+async def get_announcements(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    not_modified = await conditional_get(request, response, db, ["announcements"])
+    if not_modified:
+        return not_modified
+    
+    cache_key = response_cache.key_for(
+        request, {"limit": limit, "cursor": cursor}, version_key(request, "announcements")
+    )
+    body = await response_cache.get(cache_key)
+    if body is None:
+        body = await load_announcements(cache_key, limit, cursor)
     
-    return {"announcements": announcements}
+    return cached_response(body, response)
 
 
 @api_router.post("/announcements/ai-draft")
@@ -464,21 +657,46 @@ async def ai_draft_announcement(ai_request: AIAnnouncementRequest, request: Requ
     user = await get_current_user(request, db)
     await require_role(user, [UserRole.ADMIN, UserRole.BOARD_MEMBER])
     
-    from emergentintegrations.ai.llm_chat_engine import LlmChat, UserMessage
+    draft = await draft_service.draft(ai_request.prompt, f"announcement_{user['user_id']}")
     
-    api_key = os.getenv("EMERGENT_LLM_KEY")
-    
-    chat = LlmChat(
-        api_key=api_key,
-        session_id=f"announcement_{user['user_id']}",
-        system_message="You are a professional HOA announcement writer. Create clear, friendly, and professional announcements for homeowners association members."
-    ).with_model("openai", "gpt-5.2")
+    return {"draft": draft}
+
+
+@api_router.post("/announcements/ai-draft/stream")
+async def stream_ai_draft(ai_request: AIAnnouncementRequest, request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN, UserRole.BOARD_MEMBER])
     
-    message = UserMessage(text=f"Create a professional HOA announcement about: {ai_request.prompt}")
+    cached = draft_service.cached(ai_request.prompt)
+    if cached is None:
+        # Reject before the stream starts so clients see a real 429
+        draft_service.limiter.check()
     
-    response = await chat.send_message(message)
+    async def events():
+        if cached is not None:
+            yield format_sse({"id": 1, "event": "done", "data": {"draft": cached, "cached": True}})
+            return
+        
+        parts = []
+        try:
+            async for chunk in draft_service.stream(ai_request.prompt, f"announcement_{user['user_id']}"):
+                parts.append(chunk)
+                yield format_sse({"id": len(parts), "event": "token", "data": {"text": chunk}})
+        except HTTPException as e:
+            yield format_sse({"id": 0, "event": "error", "data": {"detail": e.detail}})
+            return
+        except Exception as e:
+            logger.error(f"AI draft failed: {e}")
+            yield format_sse({"id": 0, "event": "error", "data": {"detail": "Draft generation failed"}})
+            return
+        
+        yield format_sse({"id": len(parts) + 1, "event": "done", "data": {"draft": "".join(parts), "cached": False}})
     
-    return {"draft": response.text}
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # ==================== DOCUMENT ROUTES ====================
@@ -486,6 +704,7 @@ async def ai_draft_announcement(ai_request: AIAnnouncementRequest, request: Requ
 async def upload_document(
     title: str,
     category: str,
+    background_tasks: BackgroundTasks,
     description: Optional[str] = None,
     file: UploadFile = File(...),
     request: Request = None
@@ -494,35 +713,118 @@ async def upload_document(
     await require_role(user, [UserRole.ADMIN, UserRole.BOARD_MEMBER])
     
     document_id = f"doc_{uuid.uuid4().hex[:12]}"
-    file_url = f"/uploads/documents/{document_id}_{file.filename}"
+    stored = await store_blob(db, storage, file)
     
     document_doc = {
         "document_id": document_id,
         "title": title,
         "category": category,
-        "file_url": file_url,
+        "file_url": f"/api/documents/{document_id}/file",
         "file_name": file.filename,
-        "file_size": file.size if hasattr(file, 'size') else 0,
+        "file_size": stored.size,
+        "content_type": stored.content_type,
+        "sha256": stored.sha256,
+        "storage_key": stored.key,
         "description": description,
         "uploaded_by": user["user_id"],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.documents.insert_one(document_doc)
+    await bump_version(db, "documents", f"category:{category}")
+    await response_cache.invalidate("documents:all", f"documents:category:{category}", "search")
+    background_tasks.add_task(generate_derivatives, stored)
     
-    return {"document": {k: v for k, v in document_doc.items() if k != "_id"}}
+    return {"document": {k: v for k, v in document_doc.items() if k not in ("_id", "storage_key")}}
 
 
-@api_router.get("/documents")
-async def get_documents(category: Optional[str] = None):
+@coalesce("documents", key=lambda cache_key, category, limit, cursor: cache_key)
+async def load_documents(
+    cache_key: str, category: Optional[str], limit: int, cursor: Optional[str]
+) -> bytes:
     query = {"category": category} if category else {}
     
-    documents = await db.documents.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+    documents, next_cursor = await paginate(
+        db.documents, query, "created_at", "document_id", limit, cursor,
+        projection={"_id": 0, "storage_key": 0}
+    )
+    return await response_cache.set(
+        cache_key,
+        {"documents": documents, "next_cursor": next_cursor},
+        [f"documents:category:{category}" if category else "documents:all"]
+    )
+
+
+@api_router.get("/documents")
+async def get_documents(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    not_modified = await conditional_get(request, response, db, ["documents"])
+    if not_modified:
+        return not_modified
+    
+    # A category page only changes with uploads to that category
+    version = version_key(request, ("documents", f"category:{category}") if category else "documents")
+    cache_key = response_cache.key_for(
+        request, {"category": category, "limit": limit, "cursor": cursor}, version
+    )
+    body = await response_cache.get(cache_key)
+    if body is None:
+        body = await load_documents(cache_key, category, limit, cursor)
+    
+    return cached_response(body, response)
+
+
+@api_router.get("/documents/{document_id}/file")
+async def download_document(document_id: str, request: Request):
+    document = await db.documents.find_one({"document_id": document_id}, {"_id": 0})
+    
+    if not document or not document.get("storage_key"):
+        raise HTTPException(status_code=404, detail="Document not found")
     
-    return {"documents": documents}
+    return await file_response(
+        storage, document["storage_key"], request, document["file_name"], document.get("content_type")
+    )
+
+
+@api_router.get("/documents/{document_id}/thumbnail")
+async def get_document_thumbnail(document_id: str, request: Request):
+    document = await db.documents.find_one({"document_id": document_id}, {"_id": 0})
+    return await derivative_response(document, "thumbnail", request)
+
+
+@api_router.get("/documents/{document_id}/preview")
+async def get_document_preview(document_id: str, request: Request):
+    document = await db.documents.find_one({"document_id": document_id}, {"_id": 0})
+    return await derivative_response(document, "preview", request)
+
+
+@api_router.delete("/documents/{document_id}")
+async def delete_document(document_id: str, request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN, UserRole.BOARD_MEMBER])
+    
+    document = await db.documents.find_one_and_delete(
+        {"document_id": document_id},
+        {"_id": 0, "category": 1, "sha256": 1}
+    )
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    if document.get("sha256"):
+        await release_blob(db, document["sha256"])
+    
+    await bump_version(db, "documents", f"category:{document['category']}")
+    await response_cache.invalidate(
+        "documents:all", f"documents:category:{document['category']}", "search"
+    )
+    
+    return {"message": "Document deleted"}
 
 
 # ==================== EVENT ROUTES ====================
@@ -537,50 +839,168 @@ async def create_event(event_data: EventCreate, request: Request):
         "event_id": event_id,
         "title": event_data.title,
         "description": event_data.description,
-        "event_date": event_data.event_date.isoformat(),
+        "event_date": event_data.event_date,
         "location": event_data.location,
         "max_attendees": event_data.max_attendees,
-        "attendees": [],
+        "attendee_count": 0,
+        "waitlist_count": 0,
         "created_by": user["user_id"],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.events.insert_one(event_doc)
+    await bump_version(db, "events")
+    await response_cache.invalidate("events")
+    await hub.publish([PUBLIC_CHANNEL], "event", {
+        k: event_doc[k] for k in ("event_id", "title", "event_date", "location")
+    })
     
     return {"event": {k: v for k, v in event_doc.items() if k != "_id"}}
 
 
+@coalesce("events", key=lambda cache_key, limit, cursor: cache_key)
+async def load_events(cache_key: str, limit: int, cursor: Optional[str]) -> bytes:
+    events, next_cursor = await paginate(
+        db.events, {}, "event_date", "event_id", limit, cursor, descending=False,
+        projection={"_id": 0, "attendees": 0}
+    )
+    return await response_cache.set(
+        cache_key,
+        {"events": events, "next_cursor": next_cursor},
+        ["events"]
+    )
+
+
 @api_router.get("/events")
-async def get_events():
-    events = await db.events.find(
-        {},
-        {"_id": 0}
-    ).sort("event_date", 1).to_list(100)
+async def get_events(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    not_modified = await conditional_get(request, response, db, ["events"])
+    if not_modified:
+        return not_modified
+    
+    cache_key = response_cache.key_for(
+        request, {"limit": limit, "cursor": cursor}, version_key(request, "events")
+    )
+    body = await response_cache.get(cache_key)
+    if body is None:
+        body = await load_events(cache_key, limit, cursor)
     
-    return {"events": events}
+    return cached_response(body, response)
+
+
+async def claim_event_seat(event_id: str) -> bool:
+    """Atomically take one seat if the event is not full."""
+    result = await db.events.update_one(
+        {
+            "event_id": event_id,
+            "$or": [
+                {"max_attendees": None},
+                {"max_attendees": 0},
+                {"$expr": {"$lt": ["$attendee_count", "$max_attendees"]}}
+            ]
+        },
+        {"$inc": {"attendee_count": 1}}
+    )
+    return result.modified_count == 1
+
+
+async def promote_waitlisted(event_id: str):
+    """Give a freed seat to the longest-waiting RSVP, if any."""
+    if not await claim_event_seat(event_id):
+        return
+    
+    promoted = await db.event_rsvps.find_one_and_update(
+        {"event_id": event_id, "status": RSVPStatus.WAITLISTED},
+        {"$set": {"status": RSVPStatus.GOING}},
+        sort=[("created_at", 1), ("rsvp_id", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    
+    if promoted:
+        await db.events.update_one({"event_id": event_id}, {"$inc": {"waitlist_count": -1}})
+    else:
+        await db.events.update_one({"event_id": event_id}, {"$inc": {"attendee_count": -1}})
 
 
 @api_router.post("/events/{event_id}/attend")
 async def attend_event(event_id: str, request: Request):
     user = await get_current_user(request, db)
     
-    event = await db.events.find_one({"event_id": event_id}, {"_id": 0})
+    event = await db.events.find_one({"event_id": event_id}, {"_id": 0, "event_id": 1})
     
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
-    if user["user_id"] in event.get("attendees", []):
+    # The unique (event_id, user_id) index rejects double RSVPs
+    rsvp_id = f"rsvp_{uuid.uuid4().hex[:12]}"
+    try:
+        await db.event_rsvps.insert_one({
+            "rsvp_id": rsvp_id,
+            "event_id": event_id,
+            "user_id": user["user_id"],
+            "status": RSVPStatus.PENDING,
+            "created_at": datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError:
         raise HTTPException(status_code=400, detail="Already registered")
     
-    if event.get("max_attendees") and len(event.get("attendees", [])) >= event["max_attendees"]:
-        raise HTTPException(status_code=400, detail="Event is full")
+    if await claim_event_seat(event_id):
+        rsvp_status = RSVPStatus.GOING
+        update = {}
+    else:
+        rsvp_status = RSVPStatus.WAITLISTED
+        update = {"$inc": {"waitlist_count": 1}}
+    
+    # A cancel while the RSVP was pending deletes it without touching the counters
+    settled = await db.event_rsvps.update_one(
+        {"rsvp_id": rsvp_id, "status": RSVPStatus.PENDING},
+        {"$set": {"status": rsvp_status}}
+    )
+    if not settled.matched_count:
+        if rsvp_status == RSVPStatus.GOING:
+            # Give back the seat we just claimed
+            await db.events.update_one({"event_id": event_id}, {"$inc": {"attendee_count": -1}})
+            await promote_waitlisted(event_id)
+        await bump_version(db, "events")
+        await response_cache.invalidate("events")
+        raise HTTPException(status_code=409, detail="Registration was cancelled")
+    
+    if update:
+        await db.events.update_one({"event_id": event_id}, update)
+    await bump_version(db, "events")
+    await response_cache.invalidate("events")
     
-    await db.events.update_one(
-        {"event_id": event_id},
-        {"$push": {"attendees": user["user_id"]}}
+    if rsvp_status == RSVPStatus.WAITLISTED:
+        return {"message": "Event is full, added to the waitlist", "status": rsvp_status}
+    
+    return {"message": "Successfully registered for event", "status": rsvp_status}
+
+
+@api_router.delete("/events/{event_id}/attend")
+async def cancel_attendance(event_id: str, request: Request):
+    user = await get_current_user(request, db)
+    
+    rsvp = await db.event_rsvps.find_one_and_delete(
+        {"event_id": event_id, "user_id": user["user_id"]},
+        projection={"_id": 0}
     )
     
-    return {"message": "Successfully registered for event"}
+    if not rsvp:
+        raise HTTPException(status_code=404, detail="Not registered for this event")
+    
+    if rsvp["status"] == RSVPStatus.GOING:
+        await db.events.update_one({"event_id": event_id}, {"$inc": {"attendee_count": -1}})
+        await promote_waitlisted(event_id)
+    elif rsvp["status"] == RSVPStatus.WAITLISTED:
+        await db.events.update_one({"event_id": event_id}, {"$inc": {"waitlist_count": -1}})
+    await bump_version(db, "events")
+    await response_cache.invalidate("events")
+    
+    return {"message": "Registration cancelled"}
 
 
 # ==================== DISCUSSION ROUTES ====================
@@ -597,118 +1017,442 @@ async def create_discussion(discussion_data: DiscussionCreate, request: Request)
         "category": discussion_data.category,
         "author_id": user["user_id"],
         "author_name": user["name"],
-        "replies": [],
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "reply_count": 0,
+        "last_reply_at": None,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.discussions.insert_one(discussion_doc)
+    await bump_version(db, "discussions")
+    await response_cache.invalidate("search")
     
     return {"discussion": {k: v for k, v in discussion_doc.items() if k != "_id"}}
 
 
 @api_router.get("/discussions")
-async def get_discussions(category: Optional[str] = None):
+async def get_discussions(
+    category: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     query = {"category": category} if category else {}
     
-    discussions = await db.discussions.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+    # Summaries only; replies are paged separately
+    discussions, next_cursor = await paginate(
+        db.discussions, query, "created_at", "discussion_id", limit, cursor,
+        projection={"_id": 0, "replies": 0}
+    )
     
-    return {"discussions": discussions}
+    return {"discussions": discussions, "next_cursor": next_cursor}
 
 
 @api_router.post("/discussions/{discussion_id}/reply")
 async def reply_to_discussion(discussion_id: str, reply_data: DiscussionReply, request: Request):
     user = await get_current_user(request, db)
     
+    now = datetime.now(timezone.utc)
     reply = {
         "reply_id": f"reply_{uuid.uuid4().hex[:8]}",
+        "discussion_id": discussion_id,
         "user_id": user["user_id"],
         "user_name": user["name"],
         "content": reply_data.content,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": now
     }
     
     result = await db.discussions.update_one(
         {"discussion_id": discussion_id},
         {
-            "$push": {"replies": reply},
-            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+            "$inc": {"reply_count": 1},
+            "$set": {"last_reply_at": now, "updated_at": now}
         }
     )
     
-    if result.modified_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Discussion not found")
     
-    return {"reply": reply}
+    await db.discussion_replies.insert_one(reply)
+    
+    return {"reply": {k: v for k, v in reply.items() if k != "_id"}}
+
+
+@api_router.get("/discussions/{discussion_id}/replies")
+async def get_discussion_replies(
+    discussion_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    discussion = await db.discussions.find_one(
+        {"discussion_id": discussion_id},
+        {"_id": 0, "discussion_id": 1}
+    )
+    
+    if not discussion:
+        raise HTTPException(status_code=404, detail="Discussion not found")
+    
+    # Oldest first, in conversation order
+    replies, next_cursor = await paginate(
+        db.discussion_replies, {"discussion_id": discussion_id},
+        "created_at", "reply_id", limit, cursor, descending=False
+    )
+    
+    return {"replies": replies, "next_cursor": next_cursor}
+
+
+# ==================== SEARCH ROUTES ====================
+@coalesce("search", key=lambda cache_key, *args: cache_key)
+async def load_search(
+    cache_key: str, q: str, types: Optional[List[str]], category: Optional[str],
+    tag: Optional[str], limit: int, cursor: Optional[str]
+) -> bytes:
+    results = await search(db, q, types, category, tag, limit, cursor)
+    return await response_cache.set(cache_key, results, ["search"])
+
+
+@api_router.get("/search")
+async def search_content(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=2, max_length=200),
+    types: Optional[str] = None,
+    category: Optional[str] = None,
+    tag: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    type_list = types.split(",") if types else None
+    if type_list and not set(type_list) <= set(SEARCHABLE):
+        raise HTTPException(
+            status_code=400,
+            detail=f"types must be a comma-separated subset of {', '.join(SEARCHABLE)}"
+        )
+    
+    not_modified = await conditional_get(
+        request, response, db, ["announcements", "discussions", "documents"]
+    )
+    if not_modified:
+        return not_modified
+    
+    cache_key = response_cache.key_for(request, {
+        "q": q, "types": types, "category": category, "tag": tag, "limit": limit, "cursor": cursor
+    }, version_key(request, "announcements", "discussions", "documents"))
+    body = await response_cache.get(cache_key)
+    if body is None:
+        body = await load_search(cache_key, q, type_list, category, tag, limit, cursor)
+    
+    return cached_response(body, response)
 
 
 # ==================== NOTIFICATION ROUTES ====================
 @api_router.get("/notifications")
-async def get_notifications(request: Request):
+async def get_notifications(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     user = await get_current_user(request, db)
     
-    notifications = await db.notifications.find(
-        {"recipient_id": user["user_id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(50).to_list(50)
+    notifications, next_cursor = await list_notifications(db, user, limit, cursor)
     
-    return {"notifications": notifications}
+    return {"notifications": notifications, "next_cursor": next_cursor}
+
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_count(request: Request):
+    user = await get_current_user(request, db)
+    
+    return {"unread": await unread_count(db, user)}
+
+
+@api_router.post("/notifications/read-all")
+async def mark_all_notifications_read(request: Request, before: Optional[datetime] = None):
+    user = await get_current_user(request, db)
+    
+    # Without `before`, everything in the feed up to now is marked read
+    if before is not None and before.tzinfo is None:
+        before = before.replace(tzinfo=timezone.utc)
+    updated = await mark_all_read(db, user, before)
+    
+    return {"message": "Notifications marked as read", "updated": updated}
 
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, request: Request):
     user = await get_current_user(request, db)
     
-    await db.notifications.update_one(
-        {"notification_id": notification_id, "recipient_id": user["user_id"]},
-        {"$set": {"read": True}}
-    )
+    if not await mark_read(db, user, notification_id):
+        raise HTTPException(status_code=404, detail="Notification not found")
     
     return {"message": "Notification marked as read"}
 
 
+# ==================== STREAM ROUTES ====================
+@api_router.get("/stream")
+async def stream_updates(request: Request, last_event_id: Optional[int] = None):
+    user = await get_current_user(request, db)
+    
+    # Browsers send Last-Event-ID themselves when EventSource reconnects
+    header = request.headers.get("Last-Event-ID")
+    if header and header.isdigit():
+        last_event_id = int(header)
+    
+    subscription = hub.subscribe([PUBLIC_CHANNEL, user_channel(user["user_id"])], last_event_id)
+    
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                # A lagging subscriber gets what is queued, then reconnects to resume
+                if subscription.lagging and subscription.queue.empty():
+                    break
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(message)
+        finally:
+            hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== DASHBOARD ROUTES ====================
+DASHBOARD_SECTIONS = ("payments", "announcements", "notifications", "unread_count", "analytics")
+
+
+@api_router.get("/dashboard")
+async def get_dashboard(
+    request: Request,
+    response: Response,
+    sections: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=MAX_PAGE_SIZE)
+):
+    user = await get_current_user(request, db)
+    
+    requested = sections.split(",") if sections else list(DASHBOARD_SECTIONS)
+    unknown = [name for name in requested if name not in DASHBOARD_SECTIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown dashboard sections: {', '.join(unknown)}"
+        )
+    
+    # Analytics is admin-only; other roles simply don't get the section
+    if user.get("role") != UserRole.ADMIN:
+        requested = [name for name in requested if name != "analytics"]
+    
+    async def payments():
+        items, _ = await paginate(
+            db.payments, {"user_id": user["user_id"]}, "created_at", "payment_id", limit
+        )
+        return items
+    
+    async def announcements():
+        items, _ = await paginate(db.announcements, {}, "created_at", "announcement_id", limit)
+        return items
+    
+    async def notifications():
+        items, _ = await list_notifications(db, user, limit)
+        return items
+    
+    async def unread():
+        # From the counters, so the badge doesn't depend on how many items were listed
+        return await unread_count(db, user)
+    
+    async def analytics():
+        return await get_rollups(db)
+    
+    loaders = {
+        "payments": payments,
+        "announcements": announcements,
+        "notifications": notifications,
+        "unread_count": unread,
+        "analytics": analytics
+    }
+    timings = {}
+    
+    async def timed(name):
+        start = time.perf_counter()
+        try:
+            return await loaders[name]()
+        finally:
+            timings[name] = (time.perf_counter() - start) * 1000
+    
+    results = await asyncio.gather(*(timed(name) for name in requested))
+    
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={timings[name]:.1f}" for name in requested
+    )
+    
+    return dict(zip(requested, results))
+
+
 # ==================== ADMIN ROUTES ====================
 @api_router.get("/admin/users")
-async def get_all_users(request: Request):
+async def get_all_users(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     user = await get_current_user(request, db)
     await require_role(user, [UserRole.ADMIN])
     
-    users = await db.users.find(
-        {},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(1000)
+    users, next_cursor = await paginate(
+        db.users, {}, "created_at", "user_id", limit, cursor,
+        projection={"_id": 0, "password_hash": 0}
+    )
+    
+    return {"users": users, "next_cursor": next_cursor}
+
+
+@api_router.get("/admin/export/{dataset}")
+async def export_data(
+    dataset: str,
+    request: Request,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    method: Optional[str] = None,
+    role: Optional[str] = None,
+    user_id: Optional[str] = None,
+    payment_id: Optional[str] = None,
+    event_id: Optional[str] = None,
+    cursor: Optional[str] = None
+):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN])
+    
+    spec = EXPORTS.get(dataset)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Unknown export: {dataset}")
     
-    return {"users": users}
+    filters = {
+        "status": status_filter, "method": method, "role": role,
+        "user_id": user_id, "payment_id": payment_id, "event_id": event_id
+    }
+    unsupported = [name for name, value in filters.items() if value is not None and name not in spec.filters]
+    if unsupported:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{dataset} cannot be filtered by {', '.join(unsupported)}"
+        )
+    
+    query = build_query(spec, filters, since, until, cursor)
+    filename = f"{dataset}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{fmt}"
+    
+    # Rows stream straight from the cursor; nothing is collected in memory
+    return StreamingResponse(
+        stream_export(db, spec, query, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @api_router.get("/admin/analytics")
-async def get_analytics(request: Request):
+async def get_analytics(request: Request, months: int = Query(0, ge=0, le=120)):
     user = await get_current_user(request, db)
     await require_role(user, [UserRole.ADMIN])
     
-    total_users = await db.users.count_documents({})
-    total_payments = await db.payments.count_documents({})
-    successful_payments = await db.payments.count_documents({"status": PaymentStatus.SUCCESSFUL})
+    # Point reads of the rollup documents; months > 0 adds a monthly series
+    return await get_rollups(db, months)
+
+
+@api_router.post("/admin/analytics/rebuild")
+async def rebuild_analytics(request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN])
+    
+    rebuilt = await rebuild_rollups(db)
     
-    pipeline = [
-        {"$match": {"status": PaymentStatus.SUCCESSFUL}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]
+    return {"message": "Analytics rebuilt", "rollups": rebuilt}
+
+
+@api_router.post("/admin/notifications")
+async def create_notification(notification_data: NotificationCreate, request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN, UserRole.BOARD_MEMBER])
     
-    result = await db.payments.aggregate(pipeline).to_list(1)
-    total_revenue = result[0]["total"] if result else 0
+    # Broadcasts are stored once; targeted sends write one document per recipient
+    result = await send_notification(db, notification_data, user["user_id"])
+    
+    return result
+
+
+@api_router.get("/admin/indexes")
+async def get_index_report(request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN])
+    
+    report = await audit_indexes(db)
+    
+    return {"indexes": report}
+
+
+@api_router.get("/admin/metrics")
+async def get_metrics(request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN])
     
     return {
-        "total_users": total_users,
-        "total_payments": total_payments,
-        "successful_payments": successful_payments,
-        "total_revenue": total_revenue
+        "principal_cache": principal_cache.stats(),
+        "password_hashing": password_hashing_stats(),
+        "response_cache": response_cache.stats(),
+        "singleflight": singleflight_stats(),
+        "webhook_inbox": webhook_worker.stats(),
+        "derivatives": derivative_pipeline.stats(),
+        "pubsub": hub.stats(),
+        "ai_drafting": draft_service.stats()
     }
 
 
+@api_router.get("/admin/webhooks/dead-letter")
+async def get_dead_webhooks(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN])
+    
+    events, next_cursor = await paginate(
+        db.webhook_inbox, {"status": "dead"}, "received_at", "event_id", limit, cursor
+    )
+    
+    return {"events": events, "next_cursor": next_cursor}
+
+
+@api_router.post("/admin/webhooks/{event_id}/retry")
+async def retry_dead_webhook(event_id: str, request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN])
+    
+    if not await retry_dead_event(db, event_id):
+        raise HTTPException(status_code=404, detail="Dead-lettered event not found")
+    
+    webhook_worker.notify()
+    
+    return {"message": "Event queued for retry"}
+
+
+@api_router.post("/admin/storage/gc")
+async def run_storage_gc(request: Request):
+    user = await get_current_user(request, db)
+    await require_role(user, [UserRole.ADMIN])
+    
+    result = await collect_garbage(db, storage)
+    
+    return {"message": "Storage garbage collection finished", **result}
+
+
 # Include router
 app.include_router(api_router)
 
@@ -722,6 +1466,38 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes(db)
+
+
+@app.on_event("startup")
+async def calibrate_password_hashing():
+    await configure_password_hashing(db)
+
+
+@app.on_event("startup")
+async def start_http_client():
+    await http_client.start()
+
+
+@app.on_event("startup")
+async def start_payment_providers():
+    payment_providers.start()
+    webhook_worker.start()
+
+
+@app.on_event("startup")
+async def start_pubsub():
+    await hub.start(db)
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await hub.close()
+    await response_cache.close()
+    await webhook_worker.stop()
+    derivative_pipeline.close()
+    await payment_providers.close()
+    await http_client.close()
     client.close()
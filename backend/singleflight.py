@@ -0,0 +1,72 @@
+"""Request coalescing for identical concurrent reads.
+
+While a call for a given key is in flight, further calls with the same key
+await the same future instead of issuing their own database query. Results
+are shared between callers, so coalesced functions must return values that
+callers do not mutate (or copy them).
+
+    @coalesce("announcements", key=lambda cache_key, limit, cursor: cache_key)
+    async def load_announcements(cache_key, limit, cursor):
+        ...
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+import functools
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.collapsed = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+        else:
+            self.collapsed += 1
+
+        # A cancelled caller must not cancel the shared call for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "in_flight": len(self._inflight),
+        }
+
+
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_group(name: str) -> SingleFlight:
+    if name not in _groups:
+        _groups[name] = SingleFlight(name)
+    return _groups[name]
+
+
+def coalesce(name: str, key: Callable[..., Hashable]):
+    """Decorate an async function so concurrent calls with equal ``key(*args, **kwargs)`` share one execution."""
+    group = get_group(name)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await group.do(key(*args, **kwargs), lambda: func(*args, **kwargs))
+        return wrapper
+
+    return decorator
+
+
+def singleflight_stats() -> dict:
+    return {name: group.stats() for name, group in _groups.items()}
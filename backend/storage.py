@@ -0,0 +1,363 @@
+"""File storage for receipts and documents.
+
+Uploads are copied to the backend chunk by chunk while their SHA-256 and size
+are computed, so no upload is ever held in memory as a whole and oversized
+files are rejected as soon as they cross ``MAX_UPLOAD_BYTES``. Downloads honor
+single ``Range`` requests; full local downloads go through ``FileResponse``,
+which uses the server's zero-copy ``pathsend`` extension where available.
+
+The stored content type is sniffed from the file's leading bytes, never taken
+from the client. Only images and PDFs are served inline; everything else is
+sent as an ``attachment``, and every download carries ``nosniff``.
+
+``STORAGE_BACKEND`` selects the backend: ``local`` (default, files under
+``STORAGE_ROOT``) or ``s3`` (``S3_BUCKET``, optional ``S3_ENDPOINT_URL`` for
+S3-compatible services).
+"""
+from fastapi import HTTPException, Request, UploadFile, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pathlib import Path
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from typing import AsyncIterator, Optional, Tuple
+import hashlib
+import os
+import re
+import uuid
+
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+
+class StoredFile(BaseModel):
+    key: str
+    size: int
+    sha256: str
+    content_type: Optional[str] = None
+
+
+# Leading bytes -> type. Only these are stored as anything but octet-stream,
+# and only these are ever served inline; the client's Content-Type is ignored.
+MAGIC_NUMBERS = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+]
+INLINE_CONTENT_TYPES = {content_type for _, content_type in MAGIC_NUMBERS} | {"image/webp"}
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+def sniff_content_type(head: bytes) -> str:
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return DEFAULT_CONTENT_TYPE
+
+
+def safe_filename(filename: Optional[str]) -> str:
+    name = Path(filename or "file").name
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name) or "file"
+
+
+def _too_large():
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+    )
+
+
+class LocalStorage:
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+        (self.root / ".tmp").mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise HTTPException(status_code=400, detail="Invalid file key")
+        return path
+
+    async def stage(self, upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredFile:
+        """Copy an upload to a temporary location; ``commit`` or ``discard`` it next."""
+        digest = hashlib.sha256()
+        size = 0
+        key = f".tmp/{uuid.uuid4().hex}"
+        tmp_path = self.path(key)
+
+        content_type = None
+        handle = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            while chunk := await upload.read(CHUNK_SIZE):
+                if content_type is None:
+                    content_type = sniff_content_type(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large()
+                digest.update(chunk)
+                await run_in_threadpool(handle.write, chunk)
+            await run_in_threadpool(handle.close)
+        except BaseException:
+            await run_in_threadpool(handle.close)
+            await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+            raise
+
+        return StoredFile(
+            key=key, size=size, sha256=digest.hexdigest(),
+            content_type=content_type or DEFAULT_CONTENT_TYPE
+        )
+
+    async def commit(self, staged: StoredFile, key: str) -> StoredFile:
+        final_path = self.path(key)
+        await run_in_threadpool(final_path.parent.mkdir, parents=True, exist_ok=True)
+        await run_in_threadpool(os.replace, self.path(staged.key), final_path)
+        return staged.model_copy(update={"key": key})
+
+    async def discard(self, staged: StoredFile):
+        await self.delete(staged.key)
+
+    async def save(self, key: str, upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredFile:
+        return await self.commit(await self.stage(upload, max_bytes), key)
+
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        """Write small generated files (e.g. thumbnails) in one go."""
+        final_path = self.path(key)
+        tmp_path = self.path(f".tmp/{uuid.uuid4().hex}")
+        await run_in_threadpool(tmp_path.write_bytes, data)
+        await run_in_threadpool(final_path.parent.mkdir, parents=True, exist_ok=True)
+        await run_in_threadpool(os.replace, tmp_path, final_path)
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(self.path(key).is_file)
+
+    async def size(self, key: str) -> int:
+        return (await run_in_threadpool(os.stat, self.path(key))).st_size
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        handle = await run_in_threadpool(open, self.path(key), "rb")
+        try:
+            await run_in_threadpool(handle.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await run_in_threadpool(handle.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            await run_in_threadpool(handle.close)
+
+    async def delete(self, key: str):
+        await run_in_threadpool(self.path(key).unlink, missing_ok=True)
+
+
+class S3Storage:
+    """S3 or S3-compatible object storage through boto3 (calls run in threads)."""
+
+    # S3 multipart parts must be at least 5 MB, except the last one
+    PART_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self._s3 = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def stage(self, upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredFile:
+        """Stream an upload to a temporary object; ``commit`` or ``discard`` it next."""
+        digest = hashlib.sha256()
+        size = 0
+        key = f"tmp/{uuid.uuid4().hex}"
+        object_key = self._object_key(key)
+        buffer = bytearray()
+        parts = []
+        upload_id = None
+        content_type = None
+
+        async def flush_part():
+            nonlocal upload_id
+            if upload_id is None:
+                created = await run_in_threadpool(
+                    self._s3.create_multipart_upload, Bucket=self.bucket, Key=object_key,
+                    ContentType=content_type or DEFAULT_CONTENT_TYPE
+                )
+                upload_id = created["UploadId"]
+            part_number = len(parts) + 1
+            result = await run_in_threadpool(
+                self._s3.upload_part, Bucket=self.bucket, Key=object_key,
+                UploadId=upload_id, PartNumber=part_number, Body=bytes(buffer)
+            )
+            parts.append({"ETag": result["ETag"], "PartNumber": part_number})
+            buffer.clear()
+
+        try:
+            while chunk := await upload.read(CHUNK_SIZE):
+                if content_type is None:
+                    content_type = sniff_content_type(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large()
+                digest.update(chunk)
+                buffer.extend(chunk)
+                if len(buffer) >= self.PART_SIZE:
+                    await flush_part()
+
+            if upload_id is None:
+                # Small file: a single PUT
+                await run_in_threadpool(
+                    self._s3.put_object, Bucket=self.bucket, Key=object_key, Body=bytes(buffer),
+                    ContentType=content_type or DEFAULT_CONTENT_TYPE
+                )
+            else:
+                if buffer:
+                    await flush_part()
+                await run_in_threadpool(
+                    self._s3.complete_multipart_upload, Bucket=self.bucket, Key=object_key,
+                    UploadId=upload_id, MultipartUpload={"Parts": parts}
+                )
+        except BaseException:
+            if upload_id is not None:
+                await run_in_threadpool(
+                    self._s3.abort_multipart_upload, Bucket=self.bucket, Key=object_key,
+                    UploadId=upload_id
+                )
+            raise
+
+        return StoredFile(
+            key=key, size=size, sha256=digest.hexdigest(),
+            content_type=content_type or DEFAULT_CONTENT_TYPE
+        )
+
+    async def commit(self, staged: StoredFile, key: str) -> StoredFile:
+        # Server-side copy; the bytes do not pass through this process again
+        await run_in_threadpool(
+            self._s3.copy_object, Bucket=self.bucket, Key=self._object_key(key),
+            CopySource={"Bucket": self.bucket, "Key": self._object_key(staged.key)}
+        )
+        await self.delete(staged.key)
+        return staged.model_copy(update={"key": key})
+
+    async def discard(self, staged: StoredFile):
+        await self.delete(staged.key)
+
+    async def save(self, key: str, upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StoredFile:
+        return await self.commit(await self.stage(upload, max_bytes), key)
+
+    async def put(self, key: str, data: bytes, content_type: Optional[str] = None):
+        await run_in_threadpool(
+            self._s3.put_object, Bucket=self.bucket, Key=self._object_key(key), Body=data,
+            ContentType=content_type or "application/octet-stream"
+        )
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await run_in_threadpool(self._s3.head_object, Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def size(self, key: str) -> int:
+        head = await run_in_threadpool(self._s3.head_object, Bucket=self.bucket, Key=self._object_key(key))
+        return head["ContentLength"]
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        result = await run_in_threadpool(
+            self._s3.get_object, Bucket=self.bucket, Key=self._object_key(key),
+            Range=f"bytes={start}-{end}"
+        )
+        body = result["Body"]
+        try:
+            while chunk := await run_in_threadpool(body.read, CHUNK_SIZE):
+                yield chunk
+        finally:
+            await run_in_threadpool(body.close)
+
+    async def delete(self, key: str):
+        await run_in_threadpool(self._s3.delete_object, Bucket=self.bucket, Key=self._object_key(key))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into inclusive ``(start, end)``.
+
+    Returns ``None`` when there is no usable Range header (serve the whole
+    file); raises 416 for ranges that cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+
+    return start, min(end, size - 1)
+
+
+async def file_response(
+    storage, key: str, request: Request, filename: str, content_type: Optional[str] = None
+) -> Response:
+    # Anything not known to be an image or PDF downloads instead of rendering
+    inline = content_type in INLINE_CONTENT_TYPES
+    media_type = content_type if inline else DEFAULT_CONTENT_TYPE
+    size = await storage.size(key)
+    byte_range = parse_range(request.headers.get("Range"), size)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'{"inline" if inline else "attachment"}; filename="{safe_filename(filename)}"',
+        "X-Content-Type-Options": "nosniff"
+    }
+
+    if byte_range is None:
+        if isinstance(storage, LocalStorage):
+            return FileResponse(storage.path(key), media_type=media_type, headers=headers)
+        start, end = 0, size - 1
+        status_code = 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        storage.iter_range(key, start, end),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers
+    )
+
+
+def create_storage():
+    backend = os.getenv("STORAGE_BACKEND", "local")
+
+    if backend == "s3":
+        return S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL")
+        )
+
+    return LocalStorage(os.getenv("STORAGE_ROOT", str(Path(__file__).parent / "uploads")))
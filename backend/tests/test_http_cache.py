@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import asyncio
+import bson
+from bson.codec_options import CodecOptions
+from fastapi import Response
+from starlette.requests import Request
+
+import http_cache
+
+
+def _round_trip(doc: dict) -> dict:
+    # What Motor hands back with tz_aware=True: tzinfo is bson's FixedOffset
+    options = CodecOptions(tz_aware=True)
+    return bson.decode(bson.encode(doc, codec_options=options), codec_options=options)
+
+
+def _request(headers: dict = None) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/api/announcements",
+        "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    })
+
+
+def _stamps():
+    stored = _round_trip({
+        "_id": "announcements",
+        "version": 3,
+        "updated_at": datetime(2026, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc)
+    })
+    assert stored["updated_at"].tzinfo is not timezone.utc
+    return {"announcements": stored}
+
+
+def test_last_modified_accepts_stored_stamps():
+    last_modified = http_cache._last_modified(_stamps())
+
+    assert last_modified == datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert last_modified.tzinfo is timezone.utc
+
+
+def test_conditional_get_with_stored_stamps(monkeypatch):
+    stamps = _stamps()
+
+    async def get_versions(db, collections):
+        return stamps
+
+    monkeypatch.setattr(http_cache, "get_versions", get_versions)
+
+    response = Response()
+    assert asyncio.run(http_cache.conditional_get(_request(), response, None, ["announcements"])) is None
+    last_modified = response.headers["Last-Modified"]
+    assert parsedate_to_datetime(last_modified) == datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+    not_modified = asyncio.run(http_cache.conditional_get(
+        _request({"If-None-Match": response.headers["ETag"]}), Response(), None, ["announcements"]
+    ))
+    assert not_modified.status_code == 304
+
+    not_modified = asyncio.run(http_cache.conditional_get(
+        _request({"If-Modified-Since": last_modified}), Response(), None, ["announcements"]
+    ))
+    assert not_modified.status_code == 304
+
+
+def test_version_key_only_follows_its_tag():
+    request = _request()
+    request.state.collection_versions = {"documents": {
+        "version": 7,
+        "tags": {http_cache._tag_id("category:bylaws"): 2, http_cache._tag_id("category:minutes"): 5}
+    }}
+
+    assert http_cache.version_key(request, "documents") == "documents:7"
+    assert http_cache.version_key(request, ("documents", "category:bylaws")) == "documents:category:bylaws:2"
+    assert http_cache.version_key(request, ("documents", "category:new")) == "documents:category:new:0"
@@ -0,0 +1,29 @@
+from bson import SON
+
+import indexes
+
+
+def test_text_indexes_match_their_live_form():
+    for collection, models in indexes.INDEXES.items():
+        for model in models:
+            document = model.document
+            if "weights" not in document:
+                continue
+
+            # How listIndexes reports a text index
+            weights = {
+                field: document["weights"].get(field, 1)
+                for field, direction in document["key"].items() if direction == "text"
+            }
+            live = SON([("_fts", "text"), ("_ftsx", 1)])
+
+            assert indexes._key_of(live, weights) == indexes._declared_key(document), document["name"]
+
+
+def test_text_indexes_with_other_weights_do_not_match():
+    declared = next(
+        model.document for model in indexes.INDEXES["announcements"] if "weights" in model.document
+    )
+    live = SON([("_fts", "text"), ("_ftsx", 1)])
+
+    assert indexes._key_of(live, {"title": 1, "content": 1, "tags": 1}) != indexes._declared_key(declared)
@@ -0,0 +1,118 @@
+"""The OAuth session exchange against a local stub of the session-data endpoint."""
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import http_client as http_client_module
+from auth import exchange_session_id_for_token, session_exchange_cache
+from http_client import http_client
+
+USER_DATA = {
+    "id": "emergent_1",
+    "email": "resident@example.com",
+    "name": "Resident",
+    "picture": None,
+    "session_token": "token_1",
+}
+
+
+class StubSessionServer:
+    def __init__(self, status: int = 200, delay: float = 0.0):
+        self.status = status
+        self.delay = delay
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.json_response({"detail": "nope"}, status=self.status)
+        return web.json_response({**USER_DATA, "session_id": request.headers["X-Session-ID"]})
+
+
+def run_against(stub: StubSessionServer, scenario):
+    async def main():
+        app = web.Application()
+        app.router.add_get("/session-data", stub.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            await http_client.start()
+            return await scenario(f"http://127.0.0.1:{port}/session-data")
+        finally:
+            await http_client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    session_exchange_cache.clear()
+    yield
+    session_exchange_cache.clear()
+
+
+def test_repeated_exchange_is_served_from_cache():
+    stub = StubSessionServer()
+
+    async def scenario(url):
+        first = await exchange_session_id_for_token("sess_1", url)
+        second = await exchange_session_id_for_token("sess_1", url)
+        return first, second
+
+    first, second = run_against(stub, scenario)
+
+    assert first["email"] == USER_DATA["email"]
+    assert second == first
+    assert stub.requests == 1
+
+
+def test_concurrent_exchanges_share_one_request():
+    stub = StubSessionServer(delay=0.1)
+
+    async def scenario(url):
+        return await asyncio.gather(*(exchange_session_id_for_token("sess_2", url) for _ in range(10)))
+
+    results = run_against(stub, scenario)
+
+    assert all(result["session_id"] == "sess_2" for result in results)
+    assert stub.requests == 1
+
+
+def test_slow_upstream_times_out(monkeypatch):
+    monkeypatch.setattr(http_client_module, "HTTP_READ_TIMEOUT", 0.1)
+    monkeypatch.setattr(http_client_module, "HTTP_TOTAL_TIMEOUT", 0.2)
+    stub = StubSessionServer(delay=1.0)
+
+    async def scenario(url):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await exchange_session_id_for_token("sess_3", url)
+        return result, loop.time() - start
+
+    result, elapsed = run_against(stub, scenario)
+
+    assert result is None
+    assert elapsed < 0.9
+    # Failures are not cached
+    assert session_exchange_cache.get("sess_3") is None
+
+
+def test_non_200_upstream_is_not_cached():
+    stub = StubSessionServer(status=401)
+
+    async def scenario(url):
+        first = await exchange_session_id_for_token("sess_4", url)
+        second = await exchange_session_id_for_token("sess_4", url)
+        return first, second
+
+    first, second = run_against(stub, scenario)
+
+    assert first is None and second is None
+    assert stub.requests == 2
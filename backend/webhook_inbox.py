@@ -0,0 +1,233 @@
+"""Durable inbox for verified payment webhooks.
+
+The webhook route only verifies the event and stores it in ``webhook_inbox``
+(unique on ``event_id``, so provider retries are cheap no-ops), then acks. A
+background ``WebhookInboxWorker`` claims pending events in batches, applies
+them to ``payments`` with one ``bulk_write`` of conditional per-payment
+updates, and retries failures with exponential backoff. Events that keep
+failing are parked with status ``dead`` for an admin to inspect and retry.
+"""
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+from models import PaymentStatus
+from analytics import record_payment_status_change
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1"))
+LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_BASE_SECONDS", "2"))
+BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "900"))
+
+COMPLETED_EVENT = "checkout.session.completed"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def enqueue_webhook_event(db, provider: str, event, body: bytes) -> bool:
+    """Store a verified event; returns False if it was already received."""
+    # Fall back to a body hash when the provider gives no event id
+    event_id = event.event_id or hashlib.sha256(body).hexdigest()
+    now = _now()
+
+    try:
+        await db.webhook_inbox.insert_one({
+            "event_id": f"{provider}:{event_id}",
+            "provider": provider,
+            "event_type": event.event_type,
+            "session_id": event.session_id,
+            "payment_status": event.payment_status,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "received_at": now
+        })
+    except DuplicateKeyError:
+        return False
+
+    return True
+
+
+def _backoff(attempts: int) -> float:
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+
+
+class WebhookInboxWorker:
+    def __init__(self, db):
+        self.db = db
+        self.worker_id = f"worker_{uuid.uuid4().hex[:8]}"
+        self.processed = 0
+        self.failed = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """Wake the worker right away instead of at the next poll."""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                drained = await self.drain_once()
+            except Exception as e:
+                logger.error(f"Webhook inbox worker error: {e}")
+                drained = 0
+
+            if drained < BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _claim_batch(self) -> list:
+        now = _now()
+        due = {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            # Leases of crashed workers expire and the events become claimable again
+            {"status": "processing", "locked_until": {"$lte": now}}
+        ]}
+
+        candidates = await self.db.webhook_inbox.find(
+            due, {"_id": 0, "event_id": 1}
+        ).sort("next_attempt_at", 1).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not candidates:
+            return []
+
+        claim = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        await self.db.webhook_inbox.update_many(
+            {"$and": [{"event_id": {"$in": [c["event_id"] for c in candidates]}}, due]},
+            {
+                "$set": {
+                    "status": "processing",
+                    "claimed_by": claim,
+                    "locked_until": now + timedelta(seconds=LEASE_SECONDS)
+                },
+                "$inc": {"attempts": 1}
+            }
+        )
+
+        return await self.db.webhook_inbox.find(
+            {"claimed_by": claim, "status": "processing"}, {"_id": 0}
+        ).to_list(BATCH_SIZE)
+
+    async def drain_once(self) -> int:
+        events = await self._claim_batch()
+        if not events:
+            return 0
+
+        try:
+            await self._apply(events)
+        except Exception as e:
+            logger.error(f"Applying {len(events)} webhook events failed: {e}")
+            await self._reschedule(events, str(e))
+            self.failed += len(events)
+            return len(events)
+
+        await self.db.webhook_inbox.update_many(
+            {"event_id": {"$in": [event["event_id"] for event in events]}},
+            {
+                "$set": {"status": "done", "processed_at": _now()},
+                "$unset": {"claimed_by": "", "locked_until": ""}
+            }
+        )
+        self.processed += len(events)
+        return len(events)
+
+    async def _apply(self, events: list):
+        session_ids = list({
+            event["session_id"] for event in events
+            if event["event_type"] == COMPLETED_EVENT and event.get("session_id")
+        })
+        if not session_ids:
+            return
+
+        unpaid = await self.db.payments.find(
+            {"transaction_id": {"$in": session_ids}, "status": {"$ne": PaymentStatus.SUCCESSFUL}},
+            {"_id": 0, "payment_id": 1}
+        ).to_list(None)
+
+        if unpaid:
+            now = _now()
+            # Conditional per payment, so a concurrent or retried event can't flip it
+            # twice; analytics_pending keeps the old status until the rollups are recorded
+            await self.db.payments.bulk_write([
+                UpdateOne(
+                    {"payment_id": payment["payment_id"], "status": {"$ne": PaymentStatus.SUCCESSFUL}},
+                    [{"$set": {
+                        "analytics_pending": "$status",
+                        "status": PaymentStatus.SUCCESSFUL.value,
+                        "updated_at": now
+                    }}]
+                )
+                for payment in unpaid
+            ], ordered=False)
+
+        # Also picks up transitions whose rollups a failed earlier attempt didn't record
+        async for payment in self.db.payments.find(
+            {"transaction_id": {"$in": session_ids}, "analytics_pending": {"$exists": True}},
+            {"_id": 0}
+        ):
+            await record_payment_status_change(
+                self.db, {**payment, "status": payment["analytics_pending"]}, PaymentStatus.SUCCESSFUL
+            )
+            await self.db.payments.update_one(
+                {"payment_id": payment["payment_id"], "analytics_pending": payment["analytics_pending"]},
+                {"$unset": {"analytics_pending": ""}}
+            )
+
+    async def _reschedule(self, events: list, error: str):
+        now = _now()
+        for event in events:
+            attempts = event.get("attempts", 1)
+            update = {"last_error": error}
+            if attempts >= MAX_ATTEMPTS:
+                update["status"] = "dead"
+            else:
+                update["status"] = "pending"
+                update["next_attempt_at"] = now + timedelta(seconds=_backoff(attempts))
+
+            await self.db.webhook_inbox.update_one(
+                {"event_id": event["event_id"]},
+                {"$set": update, "$unset": {"claimed_by": "", "locked_until": ""}}
+            )
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "processed": self.processed,
+            "failed": self.failed,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+
+async def retry_dead_event(db, event_id: str) -> bool:
+    result = await db.webhook_inbox.update_one(
+        {"event_id": event_id, "status": "dead"},
+        {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": _now()}}
+    )
+    return result.modified_count == 1
@@ -15,7 +15,7 @@ export default function Dashboard() {
   const [stats, setStats] = useState(null);
   const [payments, setPayments] = useState([]);
   const [announcements, setAnnouncements] = useState([]);
-  const [notifications, setNotifications] = useState([]);
+  const [unreadCount, setUnreadCount] = useState(0);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -24,19 +24,16 @@ export default function Dashboard() {
 
   const loadDashboardData = async () => {
     try {
-      const [paymentsRes, announcementsRes, notificationsRes] = await Promise.all([
-        api.get('/payments?limit=5'),
-        api.get('/announcements?limit=5'),
-        api.get('/notifications')
-      ]);
+      const { data } = await api.get('/dashboard', {
+        params: { limit: 5, sections: 'payments,announcements,unread_count,analytics' }
+      });
 
-      setPayments(paymentsRes.data.payments || []);
-      setAnnouncements(announcementsRes.data.announcements || []);
-      setNotifications(notificationsRes.data.notifications || []);
+      setPayments(data.payments || []);
+      setAnnouncements(data.announcements || []);
+      setUnreadCount(data.unread_count || 0);
 
-      if (user?.role === 'admin') {
-        const statsRes = await api.get('/admin/analytics');
-        setStats(statsRes.data);
+      if (data.analytics) {
+        setStats(data.analytics);
       }
     } catch (error) {
       console.error('Failed to load dashboard data:', error);
@@ -71,7 +68,7 @@ export default function Dashboard() {
             <div className="flex items-center gap-4">
               <Button variant="ghost" size="icon" className="relative" data-testid="notifications-btn">
                 <Bell className="w-5 h-5" />
-                {notifications.filter(n => !n.read).length > 0 && (
+                {unreadCount > 0 && (
                   <span className="absolute top-1 right-1 w-2 h-2 bg-destructive rounded-full"></span>
                 )}
               </Button>